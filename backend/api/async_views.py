@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.decorators import classonlymethod
+
+from .relations import relations
+
+# Every thread holds its own database connection, so the pool size is
+# also the number of connections a process keeps open for these views.
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEWS['MAX_WORKERS'],
+    thread_name_prefix='api-async')
+
+
+def _call(func, *args, **kwargs):
+    close_old_connections()  # Honours CONN_MAX_AGE as a request would
+    return func(*args, **kwargs)
+
+
+async def in_pool(func, *args, **kwargs):
+    """Runs blocking `func` on the bounded pool of database threads.
+
+    Context variables (such as the SQL recorder of the request) are
+    passed along to the thread.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        executor, functools.partial(context.run, _call, func,
+                                    *args, **kwargs))
+
+
+async def load_relations(user, names):
+    """Relation id sets of `user`, loaded concurrently; None if anonymous."""
+    if not user.is_authenticated:
+        return None
+    return await asyncio.gather(
+        *(in_pool(relations.get, user, name) for name in names))
+
+
+class AsyncReadMixin:
+    """Serves viewset requests from coroutines under ASGI.
+
+    An action with an `async_<action>` coroutine gets authentication and
+    permission checks on the pool, then runs the coroutine, which can
+    fetch independent data concurrently. Other requests run the usual
+    synchronous `dispatch` on the pool. With `ASYNC_VIEWS['ENABLED']`
+    off (WSGI) the view stays synchronous.
+    """
+
+    run_async = False
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        if not settings.ASYNC_VIEWS['ENABLED']:
+            return super().as_view(actions, **initkwargs)
+        view = super().as_view(actions, run_async=True, **initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        # Copies `csrf_exempt` too: Django 3.2 decorators would hide
+        # the coroutine behind a synchronous wrapper.
+        return functools.update_wrapper(async_view, view)
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.run_async:
+            return self.async_dispatch(request, *args, **kwargs)
+        return super().dispatch(request, *args, **kwargs)
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        handler = getattr(self, f'async_{action}', None)
+        if handler is None:
+            return await in_pool(super().dispatch, request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await in_pool(self.initial, request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response,
+                                               *args, **kwargs)
+        return self.response
@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+
+from .caching import data_versions, stored_data_versions
+
+User = get_user_model()
+
+
+def _values(instance):
+    return tuple(getattr(instance, field.attname)
+                 for field in instance._meta.concrete_fields)
+
+
+def _restore(model, values):
+    names = [field.attname for field in model._meta.concrete_fields]
+    return model.from_db(model.objects.db, names, values)
+
+
+def token_data_set(key):
+    """Data set of a token and its user; `api.signals` bumps it."""
+    return 'token:' + hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class TokenCache:
+    """Process-wide LRU map of token keys to user snapshots.
+
+    Entries expire after `timeout` seconds; past `max_size` the least
+    recently used one goes. A snapshot is only trusted while the version
+    of its token in the shared cache is the one read before it, so a
+    logout or a user change in any process invalidates it everywhere.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """User and token of `key` as new instances, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, version, user, token = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        if stored_data_versions((token_data_set(key),)) != (version,):
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+        user = _restore(User, user)
+        token = _restore(Token, token)
+        token.user = user
+        return user, token
+
+    def set(self, user, token, version):
+        """Keeps a snapshot read after `version` of the token data set."""
+        with self._lock:
+            self._entries[token.key] = (time.monotonic() + self.timeout,
+                                        version, _values(user),
+                                        _values(token))
+            self._entries.move_to_end(token.key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(max_size=settings.TOKEN_AUTH_CACHE['MAX_SIZE'],
+                         timeout=settings.TOKEN_AUTH_CACHE['TIMEOUT'])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """`TokenAuthentication` that skips the database for known tokens.
+
+    Only safe methods trust the cache: requests that change data always
+    read the token and the user, so a blocked or logged out user can no
+    longer write even through another worker process.
+    """
+
+    def authenticate(self, request):
+        self.use_cache = (settings.TOKEN_AUTH_CACHE['ENABLED']
+                          and request.method in SAFE_METHODS)
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if self.use_cache:
+            cached = token_cache.get(key)
+            if cached is not None:
+                return cached
+        if not settings.TOKEN_AUTH_CACHE['ENABLED']:
+            return super().authenticate_credentials(key)
+        # Read before the database: a change committed after this read
+        # bumps the version, which makes the snapshot stale
+        version, = data_versions((token_data_set(key),))
+        user, token = super().authenticate_credentials(key)
+        if version is not None:  # Not stored, e.g. the cache is down
+            token_cache.set(user, token, version)
+        return user, token
@@ -0,0 +1,324 @@
+import gzip
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, urlencode
+from rest_framework.renderers import JSONRenderer
+
+from .async_views import in_pool
+
+GZIP_ACCEPTED = re.compile(r'\bgzip\b')
+
+# Readers idle for longer than that reload the data set in full
+CHANGE_LOG_TIMEOUT = 24 * 60 * 60
+CHANGE_LOG_READ = 50
+# Seconds a process adds events up before writing them to the cache
+COUNTER_FLUSH_INTERVAL = 10
+
+_pending_events = Counter()
+_pending_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+def data_version(name):
+    """Version of a data set; changes whenever the data set changes.
+
+    Versions are nanosecond timestamps, so a version lost from the cache
+    is replaced by a newer one instead of repeating an old value.
+    """
+    return cache.get_or_set(f'data-version:{name}', time.time_ns(),
+                            timeout=None)
+
+
+def data_versions(names):
+    """Versions of several data sets at once, in the order of `names`."""
+    keys = [f'data-version:{name}' for name in names]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        for key in keys:
+            if key not in found:  # Unlike `set`, keeps a concurrent bump
+                cache.add(key, time.time_ns(), timeout=None)
+        found = cache.get_many(keys)
+    return tuple(found.get(key) for key in keys)
+
+
+def stored_data_versions(names):
+    """Like `data_versions`, but None for versions not in the cache."""
+    keys = [f'data-version:{name}' for name in names]
+    found = cache.get_many(keys)
+    return tuple(found.get(key) for key in keys)
+
+
+def bump_data_version(name):
+    cache.set(f'data-version:{name}', time.time_ns(), timeout=None)
+
+
+def bump_data_versions(names):
+    now = time.time_ns()
+    cache.set_many({f'data-version:{name}': now for name in names},
+                   timeout=None)
+
+
+def log_change(name, items):
+    """Appends the ids of changed `items` to the change log of a data set.
+
+    Entries take consecutive positions claimed with `cache.add`, which
+    no two writers can win for one position; the stored head position
+    only tells writers where to start and readers how far the log goes.
+    """
+    key = f'changes:{name}'
+    position = change_log_head(name) + 1
+    while not cache.add(f'{key}:{position}', tuple(items),
+                        timeout=CHANGE_LOG_TIMEOUT):
+        position += 1
+    cache.set(key, position, timeout=None)
+
+
+def change_log_head(name):
+    """Position of the last entry of the change log.
+
+    Like versions, a log lost from the cache starts anew from the
+    current time, after every position readers have seen.
+    """
+    key = f'changes:{name}'
+    head = cache.get(key)
+    if head is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        head = cache.get(key)
+    return head
+
+
+def read_changes(name, position):
+    """Ids changed after `position` of the log: (new position, ids).
+
+    None means entries were lost (expired, evicted or too many to read
+    at once) and the data set has to be read in full.
+    """
+    key = f'changes:{name}'
+    keys = [f'{key}:{entry}' for entry
+            in range(position + 1, position + CHANGE_LOG_READ + 1)]
+    found = cache.get_many([key, *keys])
+    head = found.get(key)
+    changed = set()
+    for entry_key in keys:
+        if entry_key not in found:
+            break
+        changed.update(found[entry_key])
+        position += 1
+    if head is None or head > position:
+        return None
+    return position, changed
+
+
+def count_event(name):
+    """Adds one to a counter kept in the cache.
+
+    Events are added up in process memory and written at most once per
+    `COUNTER_FLUSH_INTERVAL`, on the next event, so counting costs no
+    cache write per request; the cache is that much behind.
+    """
+    global _flushed_at
+    with _pending_lock:
+        _pending_events[name] += 1
+        if time.monotonic() - _flushed_at < COUNTER_FLUSH_INTERVAL:
+            return
+        events = dict(_pending_events)
+        _pending_events.clear()
+        _flushed_at = time.monotonic()
+    for name, count in events.items():
+        key = f'counter:{name}'
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            cache.set(key, count, timeout=None)
+
+
+def read_counters(names, reset=False):
+    keys = {f'counter:{name}': name for name in names}
+    counters = cache.get_many(keys)
+    if reset:
+        cache.delete_many(keys)
+    return {name: counters.get(key, 0) for key, name in keys.items()}
+
+
+def json_response(request, content, compressed):
+    """Serves one of the rendered and gzipped bodies of a JSON response."""
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    if GZIP_ACCEPTED.search(accept_encoding):
+        response = HttpResponse(compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+        return response
+    return HttpResponse(content, content_type='application/json')
+
+
+class ReferenceDataCacheMixin:
+    """Conditional, cached GET for rarely changing reference data.
+
+    JSON responses are rendered and gzipped once per data version and
+    kept in the cache; repeated requests are served from there or
+    answered with `304 Not Modified` without touching the database.
+    """
+
+    reference_data = None
+    cache_max_age = settings.REFERENCE_DATA_CACHE['MAX_AGE']
+    cache_timeout = settings.REFERENCE_DATA_CACHE['TIMEOUT']
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, partial(super().retrieve, request, *args, **kwargs))
+
+    def cached_response(self, request, get_response):
+        if request.accepted_renderer.format != 'json':
+            return get_response()
+
+        version = data_version(self.reference_data)
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        etag = f'W/"{self.reference_data}-{version}-{path}"'
+        last_modified = version // 10**9
+
+        response = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            key = f'reference-data:{self.reference_data}:{version}:{path}'
+            body = cache.get(key)
+            if body is None:
+                response = get_response()
+                if response.status_code != 200:
+                    return response
+                content = JSONRenderer().render(response.data)
+                body = (content, gzip.compress(content))
+                cache.set(key, body, timeout=self.cache_timeout)
+            response = json_response(request, *body)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True, max_age=self.cache_max_age)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class CachedResponse:
+    """Entry of the anonymous response cache, looked up by `key`.
+
+    The entry remembers the versions of the data sets it was rendered
+    from. Bumping any of them makes the entry stale: it is replaced on
+    the next request and counted as an eviction.
+    """
+
+    events = ('hit', 'miss', 'eviction')
+    timeout = settings.RESPONSE_CACHE['TIMEOUT']
+
+    def __init__(self, key, data_sets):
+        self.key = f'response:{key}'
+        version_keys = [f'data-version:{name}'
+                        for name in sorted(set(data_sets))]
+        found = cache.get_many([self.key, *version_keys])
+        missing = {key: time.time_ns() for key in version_keys
+                   if key not in found}
+        if missing:
+            cache.set_many(missing, timeout=None)
+            found.update(missing)
+        # Read before rendering: a bump made meanwhile makes it stale
+        self.versions = [found[key] for key in version_keys]
+
+        self.body = None
+        cached = found.get(self.key)
+        if cached is None:
+            self.event = 'miss'
+        elif cached[0] != self.versions:
+            self.event = 'eviction'
+        else:
+            self.event = 'hit'
+            self.body = cached[1]
+        count_event(f'response-cache:{self.event}')
+
+    def store(self, request, response):
+        """Keeps the body of a successful DRF `response`."""
+        if response.status_code != 200:
+            return False
+        content = request.accepted_renderer.render(response.data)
+        self.body = (content, gzip.compress(content))
+        cache.set(self.key, (self.versions, self.body), timeout=self.timeout)
+        return True
+
+    def response(self, request):
+        response = json_response(request, *self.body)
+        response['X-Cache'] = 'HIT' if self.event == 'hit' else 'MISS'
+        patch_vary_headers(response, ('Accept-Encoding', 'Authorization'))
+        return response
+
+    @classmethod
+    def stats(cls, reset=False):
+        counters = read_counters(
+            [f'response-cache:{event}' for event in cls.events], reset)
+        return {event: counters[f'response-cache:{event}']
+                for event in cls.events}
+
+
+class AnonymousResponseCacheMixin:
+    """Caches whole JSON responses to anonymous GET requests.
+
+    Entries are keyed by the URL with sorted query parameters and depend
+    on the data sets named by `response_cache_data_sets()`, so a change
+    evicts only the responses that could include it.
+    """
+
+    # Data sets every cached response of the view depends on
+    response_cache_data = ()
+
+    def response_cache_data_sets(self):
+        """Data versions the response depends on; None skips the cache.
+
+        Views without declared data sets are not cached, as nothing would
+        evict their responses.
+        """
+        return list(self.response_cache_data) or None
+
+    def response_cache_entry(self, request):
+        if (not settings.RESPONSE_CACHE['ENABLED']
+                or request.user.is_authenticated
+                or request.accepted_media_type != 'application/json'):
+            return None
+        data_sets = self.response_cache_data_sets()
+        if data_sets is None:
+            return None
+        query = urlencode(sorted(
+            (name, sorted(values)) for name, values
+            in request.query_params.lists()), doseq=True)
+        url = request.build_absolute_uri(request.path)
+        return CachedResponse(
+            hashlib.md5(f'{url}?{query}'.encode()).hexdigest(), data_sets)
+
+    def anonymous_cached(self, request, get_response):
+        entry = self.response_cache_entry(request)
+        if entry is None:
+            return get_response()
+        if entry.body is None:
+            response = get_response()
+            if not entry.store(request, response):
+                return response
+        return entry.response(request)
+
+    async def async_anonymous_cached(self, request, get_response):
+        """`anonymous_cached` for a coroutine `get_response`."""
+        entry = await in_pool(self.response_cache_entry, request)
+        if entry is None:
+            return await get_response()
+        if entry.body is None:
+            response = await get_response()
+            if not await in_pool(entry.store, request, response):
+                return response
+        return entry.response(request)
@@ -1,6 +1,7 @@
 from django_filters import rest_framework as filters
 
-from recipes.models import Tag
+from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
 
 
 class FavoriteFilter(filters.BooleanFilter):
@@ -28,6 +29,7 @@ class RecipeFilterSet(filters.FilterSet):
                                              lookup_expr='exact')
     is_favorited = FavoriteFilter()
     is_in_shopping_cart = ShoppingCartFilter()
+    search = filters.CharFilter(method='filter_search')
 
     def filter_queryset(self, queryset):
         user = self.request.user
@@ -36,7 +38,23 @@ class RecipeFilterSet(filters.FilterSet):
             self.filters['is_in_shopping_cart'].extra['user'] = user
         return super().filter_queryset(queryset)
 
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
 
 class IngredientFilterSet(filters.FilterSet):
     name = filters.CharFilter(field_name='name',
                               lookup_expr='icontains')
+
+
+class PantryFilterSet(filters.FilterSet):
+    """Tags of `RecipeViewSet.cook`, checked as in `RecipeFilterSet`."""
+
+    tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
+                                             to_field_name='slug',
+                                             queryset=Tag.objects.all(),
+                                             lookup_expr='exact')
+
+    class Meta:
+        model = Recipe
+        fields = ('tags',)
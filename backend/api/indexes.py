@@ -0,0 +1,183 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from recipes.models import Component, Ingredient, Recipe, TagRecipe
+
+from .caching import change_log_head, data_version, read_changes
+
+
+class IngredientIndex:
+    """Ranked name search over the ingredient catalog, kept in memory.
+
+    The index is built lazily once per process and follows the
+    `ingredients` data version, so every worker sharing the cache
+    rebuilds its copy on the next lookup after a change.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = ()
+        self._names = ()
+        self._offsets = ()
+        self._text = ''
+
+    def search(self, query):
+        """Ingredients whose name starts with, then contains `query`."""
+        self._ensure_fresh()
+        query = query.casefold()
+        names, offsets, text = self._names, self._offsets, self._text
+
+        start = bisect_left(names, query)
+        stop = bisect_left(names, query + chr(0x10FFFF), start)
+        prefixed = range(start, stop)
+
+        contained = []
+        position = text.find(query) if query else -1
+        while position != -1:
+            index = bisect_right(offsets, position) - 1
+            end = offsets[index] + len(names[index])
+            if position + len(query) > end:
+                position = text.find(query, position + 1)
+                continue
+            if position != offsets[index]:
+                contained.append(index)
+            position = text.find(query, end + 1)
+
+        entries = self._entries
+        return ([entries[index] for index in prefixed]
+                + [entries[index] for index in contained])
+
+    def _ensure_fresh(self):
+        version = data_version('ingredients')
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build()
+                self._version = version
+
+    def _build(self):
+        ingredients = sorted(
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit'),
+            key=lambda ingredient: (ingredient[1].casefold(), ingredient[0]))
+        names = tuple(name.casefold() for _, name, _ in ingredients)
+
+        offsets, offset = [], 0
+        for name in names:
+            offsets.append(offset)
+            offset += len(name) + 1
+
+        self._entries = tuple(
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for pk, name, measurement_unit in ingredients)
+        self._names = names
+        self._offsets = tuple(offsets)
+        self._text = '\n'.join(names)
+
+
+ingredient_index = IngredientIndex()
+
+
+class PantryIndex:
+    """Inverted index from ingredients to the recipes that use them.
+
+    Answers "what can I cook" from a set of ingredients at hand without
+    joining `Component`. It is built lazily per process, then follows
+    the `recipes` change log: only the recipes listed there are read
+    again, and the whole index only when entries of the log are lost.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._position = None
+        self._postings = {}
+        self._ingredients = {}
+        self._authors = {}
+        self._tags = {}
+
+    def search(self, ingredients, tags=(), author=None, recipes=None):
+        """[(recipe id, available, missing)], best covered first.
+
+        Only recipes using at least one of `ingredients` are returned;
+        `tags` (ids), `author` and the `recipes` id set narrow them.
+        """
+        self._ensure_fresh()
+        tags = frozenset(tags)
+        with self._lock:  # Updates change the postings in place
+            available = Counter()
+            for ingredient in set(ingredients):
+                available.update(self._postings.get(ingredient, ()))
+            uses, authors = self._ingredients, self._authors
+            recipe_tags = self._tags
+            found = [
+                (recipe, count, len(uses[recipe]) - count)
+                for recipe, count in available.items()
+                if (author is None or authors.get(recipe) == author)
+                and (not tags or tags & recipe_tags.get(recipe, frozenset()))
+                and (recipes is None or recipe in recipes)
+            ]
+        found.sort(key=lambda item: (-item[1] / (item[1] + item[2]),
+                                     item[2], -item[0]))
+        return found
+
+    def _ensure_fresh(self):
+        position = self._position
+        changes = (None if position is None
+                   else read_changes('recipes', position))
+        if changes is not None and changes[0] == position:
+            return
+        with self._lock:
+            if position != self._position:
+                return  # Another thread has just caught up
+            if changes is None:
+                # Read first: changes made during the build are applied
+                # again on the next lookup
+                self._position = change_log_head('recipes')
+                self._build()
+            else:
+                self._position, changed = changes
+                self._update(changed)
+
+    def _build(self):
+        self._postings = {}
+        self._ingredients = {}
+        self._authors = {}
+        self._tags = {}
+        self._load()
+
+    def _update(self, recipes):
+        """Reads changed `recipes` again, dropping the deleted ones."""
+        for recipe in recipes:
+            for ingredient in self._ingredients.pop(recipe, ()):
+                self._postings[ingredient].discard(recipe)
+            self._authors.pop(recipe, None)
+            self._tags.pop(recipe, None)
+        self._load(recipes)
+
+    def _load(self, recipes=None):
+        """Adds `recipes` (ids, all if None) to the index."""
+        components = Component.objects.order_by()
+        recipe_tags = TagRecipe.objects.order_by()
+        authors = Recipe.objects.order_by()
+        if recipes is not None:
+            components = components.filter(recipe__in=recipes)
+            recipe_tags = recipe_tags.filter(recipe__in=recipes)
+            authors = authors.filter(pk__in=recipes)
+
+        for ingredient, recipe in components.values_list(
+                'ingredient', 'recipe').iterator():
+            self._postings.setdefault(ingredient, set()).add(recipe)
+            self._ingredients.setdefault(recipe, set()).add(ingredient)
+
+        tags = {}
+        for recipe, tag in recipe_tags.values_list(
+                'recipe', 'tag').iterator():
+            tags.setdefault(recipe, set()).add(tag)
+        self._tags.update((recipe, frozenset(tag_ids))
+                          for recipe, tag_ids in tags.items())
+        self._authors.update(authors.values_list('pk', 'author'))
+
+
+pantry_index = PantryIndex()
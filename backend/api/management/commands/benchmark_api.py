@@ -0,0 +1,169 @@
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.middleware import QueryRecorder
+from recipes.models import Component, Recipe, Tag
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет эндпоинты API через тестовый клиент: задержку '
+            '(p50/p95/p99), число запросов к БД и пик памяти.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--only', nargs='*', default=(),
+                            help='Замерить только эти эндпоинты.')
+        parser.add_argument('--user', help='E-Mail пользователя, от имени '
+                                           'которого идут запросы.')
+        parser.add_argument('--output', help='Записать результаты в JSON.')
+        parser.add_argument('--compare', help='JSON прошлого замера для '
+                                              'сравнения.')
+
+    def handle(self, *args, repeat, only, user, output, compare, **options):
+        if repeat < 2:
+            raise CommandError('Нужно хотя бы два повтора.')
+        user = self.pick_user(user)
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        endpoints = self.endpoints(user)
+        unknown = set(only) - endpoints.keys()
+        if unknown:
+            raise CommandError(f'Неизвестные эндпоинты: {sorted(unknown)}')
+
+        results = {}
+        for name, path in endpoints.items():
+            if not only or name in only:
+                results[name] = self.measure(client, path, repeat)
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'repeat': repeat,
+                'user': user.pk,
+            },
+            'results': results,
+        }
+        baseline = {}
+        if compare:
+            with open(compare, encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+        self.print_report(results, baseline)
+        if output:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def pick_user(self, email):
+        """The given user or the one with the fullest cart and feed."""
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'Пользователь {email} не найден.')
+        user = (
+            User.objects
+            .annotate(cart=Count('shopping_cart', distinct=True),
+                      follows=Count('subscriptions', distinct=True))
+            .order_by('-cart', '-follows', 'pk')
+            .first()
+        )
+        if user is None:
+            raise CommandError('Нет пользователей: запустите '
+                               'generate_dataset.')
+        return user
+
+    def endpoints(self, user):
+        recipe = Recipe.objects.order_by('-pk').values_list('pk',
+                                                            flat=True).first()
+        tags = '&'.join(f'tags={slug}' for slug in
+                        Tag.objects.values_list('slug', flat=True)[:2])
+        pages = max(Recipe.objects.count() // 6, 1)
+        endpoints = {
+            'recipes': '/api/recipes/',
+            'recipes_deep_page': f'/api/recipes/?page={pages}',
+            'recipes_by_tags': f'/api/recipes/?{tags}',
+            'recipes_favorited': '/api/recipes/?is_favorited=1',
+            'recipes_search': '/api/recipes/?search=суп',
+            'recipes_feed': '/api/recipes/feed/',
+            'subscriptions': '/api/users/subscriptions/?recipes_limit=3',
+            'users': '/api/users/',
+            'download_shopping_cart':
+                '/api/recipes/download_shopping_cart/',
+            'ingredients_search': '/api/ingredients/?name=мол',
+            'tags': '/api/tags/',
+        }
+        if recipe is not None:
+            endpoints['recipe'] = f'/api/recipes/{recipe}/'
+            endpoints['recipe_similar'] = f'/api/recipes/{recipe}/similar/'
+            pantry = ','.join(map(str, Component.objects.filter(
+                recipe=recipe).values_list('ingredient', flat=True)))
+            endpoints['recipes_cook'] = (f'/api/recipes/cook/'
+                                         f'?ingredients={pantry}')
+        return endpoints
+
+    def measure(self, client, path, repeat):
+        response = self.request(client, path)  # Warms caches and imports
+        queries = QueryRecorder()
+        with connection.execute_wrapper(queries):
+            self.request(client, path)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            self.request(client, path)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        tracemalloc.start()
+        try:
+            self.request(client, path)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        percentiles = statistics.quantiles(timings, n=100,
+                                           method='inclusive')
+        return {
+            'path': path,
+            'status': response.status_code,
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'p99_ms': round(percentiles[98], 2),
+            'queries': queries.count,
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def print_report(self, results, baseline):
+        header = (f'{"Эндпоинт":<24}{"код":>5}{"p50":>9}{"p95":>9}'
+                  f'{"p99":>9}{"SQL":>6}{"KiB":>9}')
+        if baseline:
+            header += f'{"p50 было":>10}'
+        self.stdout.write(header)
+        for name, result in results.items():
+            line = (f'{name:<24}{result["status"]:>5}'
+                    f'{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                    f'{result["p99_ms"]:>9.2f}{result["queries"]:>6}'
+                    f'{result["peak_memory_kb"]:>9.1f}')
+            if name in baseline:
+                line += f'{baseline[name]["p50_ms"]:>10.2f}'
+            self.stdout.write(line)
@@ -0,0 +1,37 @@
+from timeit import Timer
+
+from django.core.management.base import BaseCommand
+
+from api.indexes import ingredient_index
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает поиск ингредиентов по индексу в памяти '
+            'с запросом icontains через ORM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*',
+                            default=('а', 'мол', 'сыр', 'масло', 'ка'))
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, queries, repeat, **options):
+        ingredient_index.search('')  # Builds the index outside of timing
+
+        self.stdout.write(f'{"Запрос":<10}{"Найдено":>9}'
+                          f'{"ORM, мкс":>12}{"Индекс, мкс":>14}{"x":>8}')
+        for query in queries:
+            def orm():
+                return IngredientSerializer(
+                    Ingredient.objects.filter(name__icontains=query),
+                    many=True).data
+
+            def index():
+                return ingredient_index.search(query)
+
+            orm_time = min(Timer(orm).repeat(3, repeat)) / repeat * 10**6
+            index_time = min(Timer(index).repeat(3, repeat)) / repeat * 10**6
+            self.stdout.write(
+                f'{query:<10}{len(index()):>9}{orm_time:>12.1f}'
+                f'{index_time:>14.1f}{orm_time / index_time:>8.1f}')
@@ -0,0 +1,158 @@
+import json
+import statistics
+import threading
+import time
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .benchmark_api import Command as BenchmarkApiCommand
+
+ENDPOINTS = ('recipes', 'recipes_by_tags', 'recipe', 'subscriptions',
+             'ingredients_search', 'tags', 'download_shopping_cart')
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенные серверы API одними и теми же запросами и '
+            'сравнивает пропускную способность, например WSGI (gunicorn) '
+            'и ASGI (uvicorn).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='ИМЯ=URL',
+                            help='Например wsgi=http://127.0.0.1:8001 '
+                                 'asgi=http://127.0.0.1:8002')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Число одновременных соединений.')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Секунд нагрузки на каждый эндпоинт.')
+        parser.add_argument('--only', nargs='*', default=(),
+                            help='Нагрузить только эти эндпоинты.')
+        parser.add_argument('--user', help='E-Mail пользователя, от имени '
+                                           'которого идут запросы.')
+        parser.add_argument('--output', help='Записать результаты в JSON.')
+
+    def handle(self, *args, targets, concurrency, duration, only, user,
+               output, **options):
+        targets = dict(self.parse_target(target) for target in targets)
+        benchmark_api = BenchmarkApiCommand()
+        user = benchmark_api.pick_user(user)
+        token, _ = Token.objects.get_or_create(user=user)
+        headers = {'Authorization': f'Token {token.key}',
+                   'Accept': 'application/json'}
+        endpoints = benchmark_api.endpoints(user)
+        names = only or [name for name in ENDPOINTS if name in endpoints]
+        unknown = set(names) - endpoints.keys()
+        if unknown:
+            raise CommandError(f'Неизвестные эндпоинты: {sorted(unknown)}')
+
+        results = {name: {} for name in names}
+        for name in names:
+            for target, base_url in targets.items():
+                results[name][target] = self.load(
+                    base_url, endpoints[name], headers, concurrency,
+                    duration)
+
+        self.print_report(results, list(targets))
+        if output:
+            report = {
+                'meta': {
+                    'timestamp': timezone.now().isoformat(),
+                    'targets': targets,
+                    'concurrency': concurrency,
+                    'duration': duration,
+                    'user': user.pk,
+                },
+                'results': results,
+            }
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def parse_target(self, target):
+        name, _, url = target.partition('=')
+        parts = urlsplit(url)
+        if not name or parts.scheme != 'http' or not parts.hostname:
+            raise CommandError(f'Ожидается ИМЯ=http://хост:порт, а не '
+                               f'{target!r}.')
+        return name, url
+
+    def load(self, base_url, path, headers, concurrency, duration):
+        """Requests `path` from `concurrency` keep-alive connections."""
+        parts = urlsplit(base_url)
+        path = quote(parts.path.rstrip('/') + path, safe='/?&=,')
+        status = self.warm(parts, path, headers)
+        timings = []
+        errors = []
+        deadline = time.perf_counter() + duration
+
+        def worker():
+            connection = HTTPConnection(parts.hostname, parts.port,
+                                        timeout=30)
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    code = self.request(connection, path, headers)
+                except (OSError, HTTPException):
+                    connection.close()
+                    code = None
+                if code == 200:
+                    timings.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors.append(code)
+            connection.close()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = {'path': path, 'status': status,
+                  'requests': len(timings), 'errors': len(errors),
+                  'rps': round(len(timings) / elapsed, 1)}
+        if len(timings) > 1:
+            percentiles = statistics.quantiles(timings, n=100,
+                                               method='inclusive')
+            result.update(p50_ms=round(percentiles[49], 2),
+                          p95_ms=round(percentiles[94], 2),
+                          p99_ms=round(percentiles[98], 2))
+        return result
+
+    def warm(self, parts, path, headers):
+        """Makes the first request, which warms caches and imports."""
+        try:
+            return self.request(HTTPConnection(parts.hostname, parts.port),
+                                path, headers)
+        except (OSError, HTTPException) as error:
+            # E.g. a streamed response cut off by a server error
+            raise CommandError(f'{parts.netloc}{path}: {error!r}')
+
+    def request(self, connection, path, headers):
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def print_report(self, results, targets):
+        header = f'{"Эндпоинт":<22}' + ''.join(
+            f'{target + " rps":>14}{"p95":>9}{"ошибок":>8}'
+            for target in targets)
+        if len(targets) > 1:
+            header += f'{targets[-1] + "/" + targets[0]:>14}'
+        self.stdout.write(header)
+        for name, by_target in results.items():
+            line = f'{name:<22}'
+            for target in targets:
+                result = by_target[target]
+                line += (f'{result["rps"]:>14.1f}'
+                         f'{result.get("p95_ms", 0):>9.2f}'
+                         f'{result["errors"]:>8}')
+            first, last = by_target[targets[0]], by_target[targets[-1]]
+            if len(targets) > 1 and first['rps']:
+                line += f'{last["rps"] / first["rps"]:>13.2f}×'
+            self.stdout.write(line)
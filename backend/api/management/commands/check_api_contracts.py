@@ -0,0 +1,312 @@
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.db.transaction import atomic, set_rollback
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from api.middleware import QueryRecorder
+from api.pagination import PageLimitPagination
+from recipes.models import (Component, FavoriteRecipe, FeedEntry, Ingredient,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
+from users.models import Subscription
+
+User = get_user_model()
+
+IMAGE_DATA_URI = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+# Most SQL queries an action may run on a cold cache, on-commit callbacks
+# included. Budgets hold for any amount of data; only the request
+# payload may change them.
+QUERY_BUDGETS = {
+    'tags-list': 1,
+    'tags-detail': 1,
+    'ingredients-list': 1,
+    'ingredients-search': 1,
+    'ingredients-detail': 1,
+    'users-list': 4,
+    'users-detail': 3,
+    'users-me': 1,
+    'users-me-cached': 0,
+    'users-subscriptions': 4,
+    'users-subscribe': 13,
+    'users-unsubscribe': 9,
+    'users-subscribe-batch': 11,
+    'users-unsubscribe-batch': 9,
+    'recipes-list': 8,
+    'recipes-favorited': 8,
+    'recipes-by-tag': 9,
+    'recipes-feed': 9,
+    'recipes-detail': 8,
+    'recipes-similar': 3,
+    'recipes-cook': 11,
+    'recipes-favorite': 14,
+    'recipes-unfavorite': 11,
+    'recipes-add-to-cart': 18,
+    'recipes-remove-from-cart': 14,
+    'recipes-favorite-batch': 8,
+    'recipes-unfavorite-batch': 8,
+    'recipes-add-to-cart-batch': 12,
+    'recipes-remove-from-cart-batch': 11,
+    'recipes-download-shopping-cart': 2,
+    'recipes-create': 25,
+    'recipes-update': 20,
+    'recipes-update-unchanged': 16,
+    'recipes-destroy': 20,
+}
+
+# Queries of the application only: a DatabaseCache would add its own,
+# e.g. on every token cache hit (see TOKEN_AUTH_CACHE)
+CACHES = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'api-contracts',
+}}
+
+
+class Command(BaseCommand):
+    help = ('Проверяет, что число SQL-запросов каждого действия API '
+            'не выходит за бюджет и не растёт вместе с объёмом данных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=(20, 200),
+                            help='Число пользователей в наборах данных; '
+                                 'рецептов впятеро больше.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, sizes, seed, **options):
+        counts = {}
+        # Variants are built on the worker pool, outside of the requests
+        with override_settings(CACHES=CACHES, IMAGE_VARIANTS={
+                **settings.IMAGE_VARIANTS, 'ENABLED': False}):
+            for size in sizes:
+                counts[size] = self.measure(size, seed)
+
+        failures = 0
+        self.stdout.write(f'{"Действие":<32}'
+                          + ''.join(f'{size:>8}' for size in sizes)
+                          + f'{"бюджет":>8}')
+        for action, budget in QUERY_BUDGETS.items():
+            measured = [counts[size][action] for size in sizes]
+            failed = max(measured) > budget or len(set(measured)) > 1
+            failures += failed
+            line = (f'{action:<32}'
+                    + ''.join(f'{count:>8}' for count in measured)
+                    + f'{budget:>8}')
+            self.stdout.write(self.style.ERROR(line) if failed else line)
+
+        if failures:
+            raise CommandError(f'Нарушено контрактов: {failures}')
+        self.stdout.write(self.style.SUCCESS('Все бюджеты соблюдены.'))
+
+    def measure(self, size, seed):
+        """Runs every action on a fresh dataset, then rolls it back."""
+        with atomic():
+            call_command('generate_dataset', users=size, recipes=size * 5,
+                         seed=seed, stdout=StringIO())
+            counts, images = Scenario().run()
+            set_rollback(True)
+        for image in images:
+            # Files are shared by identical images, maybe of real recipes
+            if not Recipe.objects.filter(image=image).exists():
+                default_storage.delete(image)
+        return counts
+
+
+class Scenario:
+    """Calls each action as a user with full pages of everything."""
+
+    page_size = PageLimitPagination.page_size
+
+    def __init__(self):
+        self.counts = {}
+        self.images = []
+
+    def run(self):
+        self.set_up()
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.first()
+        recipe = self.recipe.pk
+
+        self.call('tags-list', 'get', '/api/tags/')
+        self.call('tags-detail', 'get', f'/api/tags/{tag.pk}/')
+        self.call('ingredients-list', 'get', '/api/ingredients/')
+        self.call('ingredients-search', 'get', '/api/ingredients/?name=мол')
+        self.call('ingredients-detail', 'get',
+                  f'/api/ingredients/{ingredient.pk}/')
+
+        self.call('users-list', 'get', '/api/users/')
+        self.call('users-detail', 'get', f'/api/users/{self.author.pk}/')
+        self.call('users-me', 'get', '/api/users/me/')
+        # The token is known from the previous request
+        self.call('users-me-cached', 'get', '/api/users/me/', warm=True)
+        self.call('users-subscriptions', 'get',
+                  '/api/users/subscriptions/?recipes_limit=3')
+        self.call('users-subscribe', 'post',
+                  f'/api/users/{self.author.pk}/subscribe/', status=201)
+        self.call('users-unsubscribe', 'delete',
+                  f'/api/users/{self.author.pk}/subscribe/', status=204)
+        authors = {'authors': self.batch_authors}
+        self.call('users-subscribe-batch', 'post', '/api/users/subscribe/',
+                  authors)
+        self.call('users-unsubscribe-batch', 'delete',
+                  '/api/users/subscribe/', authors)
+
+        self.call('recipes-list', 'get', '/api/recipes/')
+        self.call('recipes-favorited', 'get', '/api/recipes/?is_favorited=1')
+        self.call('recipes-by-tag', 'get', f'/api/recipes/?tags={tag.slug}')
+        self.call('recipes-feed', 'get', '/api/recipes/feed/')
+        self.check_list_parity(tag)
+        self.call('recipes-detail', 'get', f'/api/recipes/{recipe}/')
+        self.call('recipes-similar', 'get',
+                  f'/api/recipes/{recipe}/similar/')
+        pantry = ','.join(map(str, Component.objects.filter(
+            recipe=recipe).values_list('ingredient', flat=True)))
+        self.call('recipes-cook', 'get',
+                  f'/api/recipes/cook/?ingredients={pantry}')
+        self.call('recipes-favorite', 'post',
+                  f'/api/recipes/{recipe}/favorite/', status=201)
+        self.call('recipes-unfavorite', 'delete',
+                  f'/api/recipes/{recipe}/favorite/', status=204)
+        self.call('recipes-add-to-cart', 'post',
+                  f'/api/recipes/{recipe}/shopping_cart/', status=201)
+        self.call('recipes-remove-from-cart', 'delete',
+                  f'/api/recipes/{recipe}/shopping_cart/', status=204)
+        recipes = {'recipes': self.batch_recipes}
+        self.call('recipes-favorite-batch', 'post', '/api/recipes/favorite/',
+                  recipes)
+        self.call('recipes-unfavorite-batch', 'delete',
+                  '/api/recipes/favorite/', recipes)
+        self.call('recipes-add-to-cart-batch', 'post',
+                  '/api/recipes/shopping_cart/', recipes)
+        self.call('recipes-remove-from-cart-batch', 'delete',
+                  '/api/recipes/shopping_cart/', recipes)
+        self.call('recipes-download-shopping-cart', 'get',
+                  '/api/recipes/download_shopping_cart/')
+
+        tags = list(Tag.objects.values_list('pk', flat=True)[:2])
+        # Shares ingredients with other recipes, so it has neighbours.
+        ingredients = list(Component.objects.filter(
+            recipe=recipe).values_list('ingredient', flat=True)[:3])
+        payload = {
+            'name': 'Проверка контрактов', 'text': 'Текст рецепта.',
+            'cooking_time': 10, 'image': IMAGE_DATA_URI, 'tags': tags,
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+        }
+        created = self.call('recipes-create', 'post', '/api/recipes/',
+                            payload, status=201).json()['id']
+        payload.update(name='Проверка контрактов 2',
+                       ingredients=[{'id': pk, 'amount': 20}
+                                    for pk in reversed(ingredients)])
+        self.call('recipes-update', 'put', f'/api/recipes/{created}/',
+                  payload)
+        # Nothing differs, so nothing is written
+        self.call('recipes-update-unchanged', 'put',
+                  f'/api/recipes/{created}/', payload)
+        self.images.append(Recipe.objects.get(pk=created).image.name)
+        self.call('recipes-destroy', 'delete', f'/api/recipes/{created}/',
+                  status=204)
+        return self.counts, self.images
+
+    def set_up(self):
+        user = User.objects.create_user(
+            email='contracts@example.com', username='contracts',
+            first_name='Контракт', last_name='Проверка', password=None)
+        token = Token.objects.create(user=user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        authors = list(
+            User.objects.exclude(pk=user.pk)
+            .annotate(recipes_total=Count('recipes'))
+            .filter(recipes_total__gt=0)
+            .order_by('pk')[:self.page_size * 2 + 1])
+        recipes = list(
+            Recipe.objects.exclude(author=user)
+            .order_by('pk')[:self.page_size * 2 + 1])
+        if (len(authors) <= self.page_size * 2
+                or len(recipes) <= self.page_size * 2):
+            raise CommandError('Слишком маленький набор данных.')
+        self.author = authors.pop()
+        self.recipe = recipes.pop()
+        # Batch requests take a page of ids the user has not listed yet
+        self.batch_authors = [author.pk for author
+                              in authors[self.page_size:]]
+        self.batch_recipes = [recipe.pk for recipe
+                              in recipes[self.page_size:]]
+        authors = authors[:self.page_size]
+        favorites = recipes[:self.page_size]
+        # The cart shares no ingredient with recipes added to it later,
+        # so adding them changes the same shopping list rows at any size.
+        added = Component.objects.filter(
+            recipe__in=(self.recipe.pk, *self.batch_recipes))
+        cart = list(
+            Recipe.objects.exclude(author=user)
+            .exclude(pk__in=[recipe.pk for recipe in recipes])
+            .exclude(pk=self.recipe.pk)
+            .exclude(ingredients__ingredient__in=added.values('ingredient'))
+            .order_by('pk')[:self.page_size])
+        if len(cart) < self.page_size:
+            raise CommandError('Слишком маленький набор данных.')
+
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=user, author=author)
+            for author in authors)
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=user, recipe=recipe)
+            for recipe in favorites)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=user, recipe=recipe) for recipe in cart)
+        ShoppingListItem.objects.rebuild((user.pk,))
+        FeedEntry.objects.rebuild((user.pk,))
+
+    def check_list_parity(self, tag):
+        """The fast recipe list renders exactly as `RecipeSerializer`."""
+        paths = ('/api/recipes/', '/api/recipes/?is_favorited=1',
+                 f'/api/recipes/?tags={tag.slug}&limit=50',
+                 '/api/recipes/?pagination=cursor&limit=50',
+                 '/api/recipes/?search=суп')
+        serializer_path = override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK, 'RECIPE_LIST_FAST_PATH': False})
+        for client in (self.client, APIClient()):
+            for path in paths:
+                # Anonymous pages would come from the response cache
+                caches['default'].clear()
+                fast = client.get(path).content
+                caches['default'].clear()
+                with serializer_path:
+                    slow = client.get(path).content
+                if fast != slow:
+                    raise CommandError(f'{path}: быстрый список рецептов '
+                                       f'расходится с RecipeSerializer.')
+
+    def call(self, action, method, path, data=None, status=200,
+             warm=False):
+        if not warm:
+            caches['default'].clear()  # Budgets hold for a cold cache
+            token_cache.clear()
+        recorder = QueryRecorder()
+        # The dataset transaction never commits, so the callbacks of a
+        # request are run right after it, as a commit would, and counted
+        with connection.execute_wrapper(recorder), \
+                TestCase.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(path, data,
+                                                    format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        if response.status_code != status:
+            raise CommandError(f'{action}: ответ {response.status_code} '
+                               f'вместо {status}: {response.content!r}')
+        self.counts[action] = recorder.count
+        return response
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.caching import CachedResponse
+
+
+class Command(BaseCommand):
+    help = ('Показывает попадания, промахи и вытеснения кэша ответов '
+            'анонимным пользователям.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счётчики после вывода.')
+
+    def handle(self, *args, reset, **options):
+        stats = CachedResponse.stats(reset)
+        requests = sum(stats.values())
+        for event, count in stats.items():
+            self.stdout.write(f'{event:<10}{count:>10}')
+        if requests:
+            self.stdout.write(
+                f'{"hit rate":<10}{stats["hit"] / requests:>10.1%}')
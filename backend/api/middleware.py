@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('api.sql')
+
+PLACEHOLDERS = re.compile(r'%s(?:\s*,\s*%s)+')
+
+# Recorder of the request being served, whichever thread runs its SQL
+active_recorder = ContextVar('active_recorder', default=None)
+
+
+class RepeatedQueryError(Exception):
+    """The same SQL shape ran too many times in one request."""
+
+
+def fingerprint(sql):
+    """SQL shape: `IN (%s, %s, ...)` lists of any length look alike."""
+    return PLACEHOLDERS.sub('%s, ...', sql)
+
+
+class QueryRecorder:
+    """`execute_wrapper` hook counting queries, their time and shapes."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.duration += time.perf_counter() - start
+                self.count += 1
+                self.shapes[fingerprint(sql)] += 1
+
+    def repeated(self, threshold):
+        return {shape: count for shape, count in self.shapes.items()
+                if count > threshold}
+
+
+def record_active(execute, sql, params, many, context):
+    """`execute_wrapper` hook passing queries to `active_recorder`."""
+    recorder = active_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recording(connection, **kwargs):
+    # First in the list: `execute_wrapper()` contexts open around a new
+    # connection pop the last wrapper on exit, which must stay theirs.
+    if record_active not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_active)
+
+
+class QueryInspectionMiddleware:
+    """Reports the SQL a request ran and flags repeated query shapes.
+
+    Adds a `Server-Timing` header and an `api.sql` log line per request.
+    A shape repeated more than `DUPLICATE_THRESHOLD` times (usually an
+    N+1) is logged as a warning, or raises `RepeatedQueryError` when
+    `RAISE` is set. Queries run on other threads on behalf of the
+    request (async views) are counted too; those run while a streaming
+    response is consumed are not.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = settings.SQL_INSPECTION
+        if not config.get('ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = config.get('DUPLICATE_THRESHOLD', 5)
+        self.raise_on_repeat = config.get('RAISE', False)
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the instance as a coroutine function, as Django's
+            # MiddlewareMixin does, so ASGI requests stay on the loop.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+        connection_created.connect(install_recording,
+                                   dispatch_uid='api.sql.recording')
+        for connection in connections.all():
+            install_recording(connection)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        token = active_recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            active_recorder.reset(token)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = active_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            active_recorder.reset(token)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        duration = recorder.duration * 1000
+        repeated = recorder.repeated(self.threshold)
+        response['Server-Timing'] = (
+            f'db;dur={duration:.1f};desc="{recorder.count} queries"')
+
+        stats = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': recorder.count,
+            'db_ms': round(duration, 1),
+            'repeated': repeated,
+        }
+        logger.info('%(method)s %(path)s %(status)s queries=%(queries)d '
+                    'db_ms=%(db_ms).1f', stats, extra={'sql': stats})
+        if repeated:
+            logger.warning(
+                '%s %s repeated query shapes: %s', request.method,
+                request.path, repeated, extra={'sql': stats})
+            if self.raise_on_repeat:
+                raise RepeatedQueryError(repeated)
+        return response
@@ -1,7 +1,105 @@
+import json
+from collections import OrderedDict
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = settings.REST_FRAMEWORK.get('PAGELIMITPAGINATION_PAGE_SIZE', 6)
+
+
+class CursorLimitPagination(CursorPagination):
+    """Keyset pagination: a deep page costs as much as the first one.
+
+    No total is counted unless `?count=bounded` (exact up to
+    `count_bound`) or `?count=estimate` (planner estimate on PostgreSQL)
+    is requested.
+    """
+
+    page_size_query_param = 'limit'
+    page_size = PageLimitPagination.page_size
+    ordering = '-pk'
+
+    count_query_param = 'count'
+    count_bound = settings.REST_FRAMEWORK.get('CURSOR_PAGINATION_COUNT_BOUND',
+                                              1000)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.count_exact = None
+        mode = request.query_params.get(self.count_query_param)
+        vendor = connections[queryset.db].vendor
+        if mode == 'estimate' and vendor == 'postgresql':
+            self.count = self.estimate_count(queryset)
+            self.count_exact = False
+        elif mode in ('bounded', 'estimate'):
+            count = queryset.order_by()[:self.count_bound + 1].count()
+            self.count = min(count, self.count_bound)
+            self.count_exact = count <= self.count_bound
+        return super().paginate_queryset(queryset, request, view)
+
+    def estimate_count(self, queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = OrderedDict(
+                count=self.count, count_exact=self.count_exact,
+                **response.data)
+        return response
+
+
+class RecipePagination(PageLimitPagination):
+    """Page numbers or keyset cursors, per request.
+
+    `?cursor=` or `?pagination=cursor` select cursors, `?page=` or
+    `?pagination=page` select page numbers; otherwise the
+    `RECIPE_PAGINATION` setting decides. Querysets ordered other than
+    by `-pk` (e.g. ranked by search) always get page numbers.
+    """
+
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CursorLimitPagination
+    default_mode = settings.REST_FRAMEWORK.get('RECIPE_PAGINATION', 'page')
+
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if self.use_cursor(queryset, request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def use_cursor(self, queryset, request):
+        ordering = tuple(queryset.query.order_by)
+        if ordering not in ((), (self.cursor_pagination_class.ordering,)):
+            return False
+
+        params = request.query_params
+        if self.cursor_pagination_class.cursor_query_param in params:
+            return True
+        if self.page_query_param in params:
+            return False
+        return params.get(self.mode_query_param,
+                          self.default_mode) == 'cursor'
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.transaction import on_commit
+from django.utils.module_loading import import_string
+
+from recipes.models import FavoriteRecipe, ShoppingCart
+from users.models import Subscription
+
+RECIPE_RELATIONS = ('favorites', 'shopping_cart', 'subscriptions')
+
+RELATIONS = {
+    'favorites': lambda user: FavoriteRecipe.objects.filter(
+        user=user).values_list('recipe', flat=True),
+    'shopping_cart': lambda user: ShoppingCart.objects.filter(
+        user=user).values_list('recipe', flat=True),
+    'subscriptions': lambda user: Subscription.objects.filter(
+        subscriber=user).values_list('author', flat=True),
+}
+
+
+class CacheBackend:
+    """Keeps id sets in a Django cache; shared if the cache is shared.
+
+    Sets are stored with the version they were loaded at. An update
+    only bumps the version, so concurrent updates cannot overwrite each
+    other, and a set loaded before the update is read again.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]  # Cache connections are per thread
+
+    def get(self, key, load, timeout):
+        members_key = f'{key}:members'
+        found = self.cache.get_many([members_key, f'{key}:version'])
+        version = self._version(key, found)
+        entry = found.get(members_key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        members = frozenset(load())
+        self.cache.set(members_key, (version, members), timeout=timeout)
+        return members
+
+    def update(self, key):
+        self.cache.set(f'{key}:version', time.time_ns(), timeout=None)
+
+    def _version(self, key, found):
+        """Version of set `key` among `found` cache values, added if none."""
+        version_key = f'{key}:version'
+        version = found.get(version_key)
+        if version is None:  # Unlike `set`, keeps a concurrent bump
+            self.cache.add(version_key, time.time_ns(), timeout=None)
+            version = self.cache.get(version_key)
+        return version
+
+
+class LocMemBackend(CacheBackend):
+    """Keeps id sets in process memory, versioned in a Django cache.
+
+    Only the versions go through the cache, so with a shared cache an
+    update made by any worker makes the other copies stale. At most
+    `max_entries` sets are kept, the least recently used dropped first.
+    """
+
+    def __init__(self, alias='default', max_entries=10000):
+        super().__init__(alias)
+        self.max_entries = max_entries
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load, timeout):
+        version = self._version(key, self.cache.get_many([f'{key}:version']))
+        with self._lock:
+            entry = self._sets.get(key)
+            if entry is not None:
+                self._sets.move_to_end(key)
+        if (entry is not None and entry[0] == version
+                and entry[1] > time.monotonic()):
+            return entry[2]
+        # Stored under the version read before loading: an update made
+        # meanwhile makes it stale
+        members = frozenset(load())
+        with self._lock:
+            self._sets[key] = (version, time.monotonic() + timeout, members)
+            self._sets.move_to_end(key)
+            while len(self._sets) > self.max_entries:
+                self._sets.popitem(last=False)
+        return members
+
+
+class UserRelations:
+    """Per-user sets of favorite, in-cart recipe and followed author ids.
+
+    Pages are fetched without per-row subqueries; their flags are then
+    filled in by set membership. The sets load lazily on first use and
+    load again after a transaction that changed them commits.
+    """
+
+    def __init__(self, backend, timeout):
+        self.backend = backend
+        self.timeout = timeout
+
+    def get(self, user, relation):
+        return self.backend.get(self._key(user, relation),
+                                partial(RELATIONS[relation], user),
+                                self.timeout)
+
+    def changed(self, user, relation):
+        """Makes the set reload once the current transaction commits."""
+        on_commit(lambda: self.backend.update(self._key(user, relation)))
+
+    def mark_recipes(self, user, recipes, sets=None):
+        """Sets the relation flags of `recipes` and their authors.
+
+        `sets` are the `RECIPE_RELATIONS` sets, if already loaded.
+        """
+        if not user.is_authenticated:
+            return
+        favorites, shopping_cart, subscriptions = sets or [
+            self.get(user, relation) for relation in RECIPE_RELATIONS]
+        for recipe in recipes:
+            recipe.is_favorited = recipe.id in favorites
+            recipe.is_in_shopping_cart = recipe.id in shopping_cart
+            recipe.author.is_subscribed = (recipe.author_id
+                                           in subscriptions)
+
+    def mark_users(self, user, users):
+        if not user.is_authenticated:
+            return
+        subscriptions = self.get(user, 'subscriptions')
+        for author in users:
+            author.is_subscribed = author.id in subscriptions
+
+    def _key(self, user, relation):
+        return f'relations:{user.pk}:{relation}'
+
+
+relations = UserRelations(
+    import_string(settings.RELATIONS_CACHE['BACKEND'])(
+        **settings.RELATIONS_CACHE.get('OPTIONS', {})),
+    timeout=settings.RELATIONS_CACHE['TIMEOUT'])
@@ -1,15 +1,22 @@
 import base64
+from collections import Counter
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
+from django.db.models import F, prefetch_related_objects
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import (Component, FavoriteRecipe, Ingredient, Recipe,
-                            ShoppingCart, Tag)
+from recipes.images import release_image, schedule_variants
+from recipes.models import (Component, FavoriteRecipe, FeedEntry, Ingredient,
+                            Recipe, ShoppingCart, ShoppingListItem,
+                            SimilarRecipe, Tag)
+
+from .signals import components_written
 
 User = get_user_model()
 
@@ -34,21 +41,104 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def as_id(value):
+    """`value` as an integer id, or None if it does not look like one."""
+    if isinstance(value, str) and value.isdecimal():
+        return int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class TagListSerializer(serializers.ListSerializer):
+    """Looks all tags up with one query and lists every wrong id."""
+
+    default_error_messages = {
+        key: serializers.PrimaryKeyRelatedField.default_error_messages[key]
+        for key in ('does_not_exist', 'incorrect_type')}
+    default_error_messages['duplicate'] = (
+        'Тэг {pk_value} указан больше одного раза.')
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and not data:
+            self.fail('empty')
+        tags = Tag.objects.in_bulk({as_id(value) for value in data} - {None})
+        found, errors = [], []
+        for value in data:
+            pk = as_id(value)
+            if pk is None:
+                errors.append(self.error_messages['incorrect_type'].format(
+                    data_type=type(value).__name__))
+            elif pk not in tags:
+                errors.append(self.error_messages['does_not_exist'].format(
+                    pk_value=value))
+            else:
+                found.append(tags[pk])
+        errors += [self.error_messages['duplicate'].format(pk_value=pk)
+                   for pk, count in Counter(tag.pk for tag in found).items()
+                   if count > 1]
+        if errors:
+            raise serializers.ValidationError(list(dict.fromkeys(errors)))
+        return found
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = '__all__'
+        list_serializer_class = TagListSerializer
 
     def to_internal_value(self, data):
         return get_object_or_404(Tag, id=data)
 
 
+class ComponentListSerializer(serializers.ListSerializer):
+    """Looks the ingredients of all components up with one query.
+
+    Items are still validated one by one, so errors keep their places.
+    """
+
+    def to_internal_value(self, data):
+        items = data if isinstance(data, list) else ()
+        self.ingredients = Ingredient.objects.in_bulk(
+            {as_id(item.get('id')) for item in items
+             if isinstance(item, dict)} - {None})
+        self.seen = set()
+        return super().to_internal_value(data)
+
+
+class IngredientIdField(serializers.PrimaryKeyRelatedField):
+    """Ingredient of a component, among those its list has looked up."""
+
+    default_error_messages = {
+        'duplicate': 'Ингредиент {pk_value} указан больше одного раза.',
+    }
+
+    def to_internal_value(self, data):
+        components = self.parent.parent
+        if not isinstance(components, ComponentListSerializer):
+            return super().to_internal_value(data)
+        pk = as_id(data)
+        if pk is None:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        ingredient = components.ingredients.get(pk)
+        if ingredient is None:
+            self.fail('does_not_exist', pk_value=data)
+        if ingredient.pk in components.seen:
+            self.fail('duplicate', pk_value=data)
+        components.seen.add(ingredient.pk)
+        return ingredient
+
+
 class ComponentSerializer(IngredientSerializer):
     class Meta:
         model = Component
         fields = ('id', 'amount')
+        list_serializer_class = ComponentListSerializer
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = IngredientIdField(queryset=Ingredient.objects.all())
 
     def to_representation(self, instance):
         data = IngredientSerializer().to_representation(
@@ -58,20 +148,54 @@ class ComponentSerializer(IngredientSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'too_large': 'Картинка больше {max_size} МБ.',
+        'too_many_pixels': 'Картинка больше {max_pixels} мегапикселей.',
+    }
+
     def to_internal_value(self, data):
+        max_size = settings.IMAGE_VARIANTS['MAX_UPLOAD_SIZE']
         if isinstance(data, str) and data.startswith('data:image'):
             format, image_str = data.split(';base64,')
+            if len(image_str) * 3 // 4 > max_size:  # Before decoding
+                self.fail('too_large', max_size=max_size // 2**20)
             ext = format.split('/')[-1]
             data = ContentFile(base64.b64decode(image_str),
                                name='recipe.' + ext)
-        return super().to_internal_value(data)
+        image = super().to_internal_value(data)
+        if image.size > max_size:
+            self.fail('too_large', max_size=max_size // 2**20)
+        # Set by Django's ImageField; Pillow reads only the header
+        width, height = image.image.size
+        max_pixels = settings.IMAGE_VARIANTS['MAX_PIXELS']
+        if width * height > max_pixels:
+            self.fail('too_many_pixels', max_pixels=max_pixels // 10**6)
+        return image
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URLs of the smaller copies of an image, by variant name.
+
+    Empty until `recipes.images` makes them; clients then fall back to
+    the original image.
+    """
+
+    def to_representation(self, value):
+        storage = Recipe._meta.get_field('image').storage
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in value.items():
+            url = storage.url(name)
+            urls[variant] = (request.build_absolute_uri(url)
+                             if request is not None else url)
+        return urls
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'author', 'name', 'text', 'tags',
-                  'image', 'cooking_time', 'ingredients',
+                  'image', 'image_variants', 'cooking_time', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart')
         validators = (UniqueTogetherValidator(
             queryset=Recipe.objects.all(), fields=('author', 'name')),)
@@ -80,6 +204,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     ingredients = ComponentSerializer(many=True)
     image = Base64ImageField(required=True)
+    image_variants = ImageVariantsField()
 
     is_favorited = serializers.BooleanField(read_only=True, default=False)
     is_in_shopping_cart = serializers.BooleanField(read_only=True,
@@ -89,12 +214,22 @@ class RecipeSerializer(serializers.ModelSerializer):
         value['author'] = self.context['request'].user
         return super().run_validators(value)
 
+    def to_representation(self, instance):
+        # No-op for prefetched querysets; saves a query per component
+        # for a recipe just created or updated.
+        prefetch_related_objects((instance,), 'tags',
+                                 'ingredients__ingredient')
+        return super().to_representation(instance)
+
     @atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
 
         recipe = Recipe.objects.create(**validated_data)
+        User.objects.filter(pk=recipe.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+        FeedEntry.objects.publish(recipe)
         recipe.tags.set(tags)
         (
             Component.objects
@@ -104,35 +239,60 @@ class RecipeSerializer(serializers.ModelSerializer):
                           amount=ingredient['amount'])
                 for ingredient in ingredients])
         )
+        SimilarRecipe.objects.refresh(recipe)
+        schedule_variants(recipe)
         return recipe
 
     @atomic
     def update(self, instance, validated_data):
+        """Writes only what differs from the recipe as it is."""
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
 
-        instance.ingredients.all().delete()
-        instance.image.delete()  # Removes previous image file from filesystem
-
-        instance.save(update_fields=validated_data)
-        instance.tags.set(tags)
-        (
-            Component.objects
-            .bulk_create([
-                Component(recipe=instance,
-                          ingredient=ingredient['id'],
-                          amount=ingredient['amount'])
-                for ingredient in ingredients])
-        )
-        return super().update(instance, validated_data)
+        image, variants = instance.image.name, instance.image_variants
+        if 'image' in validated_data:
+            # Stored under a name given by its content: an image sent
+            # again keeps its file and variants
+            upload = validated_data.pop('image')
+            instance.image.save(upload.name, upload, save=False)
+        changed = [field for field, value in validated_data.items()
+                   if getattr(instance, field) != value]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        if instance.image.name != image:
+            release_image(image, variants)
+            instance.image_variants = {}
+            changed += ['image', 'image_variants']
+        if changed:
+            instance.save(update_fields=changed)
+
+        amounts = {ingredient['id'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        before = Component.objects.set_amounts(instance, amounts)
+        if before != amounts:
+            components_written(instance)
+            ShoppingListItem.objects.change_recipe(instance, before, amounts)
+        current = {tag.pk for tag in instance.tags.all()}
+        tag_ids = {tag.pk for tag in tags}
+        if current - tag_ids:
+            instance.tags.remove(*(current - tag_ids))
+        if tag_ids - current:
+            instance.tags.add(*(tag_ids - current))
+        if before.keys() != amounts.keys() or current != tag_ids:
+            SimilarRecipe.objects.refresh(instance)
+        if not instance.image_variants:
+            schedule_variants(instance)
+        return instance
 
 
 class RecipeInListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
         read_only_fields = fields
 
+    image_variants = ImageVariantsField()
+
 
 class FavoriteRecipeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -152,13 +312,24 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         return RecipeInListSerializer(instance.recipe).data
 
 
+def batch_ids_field():
+    return serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=settings.BATCH_MUTATIONS['MAX_ITEMS'],
+        error_messages={'max_length': 'Не больше {max_length} id за раз.'})
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    recipes = batch_ids_field()
+
+
+class AuthorBatchSerializer(serializers.Serializer):
+    authors = batch_ids_field()
+
+
 class AuthorSerializer(UserSerializer):
     class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + ('recipes',)
-
-    recipes = RecipeInListSerializer(many=True)
+        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['recipes_count'] = len(data['recipes'])
-        return data
+    recipes = RecipeInListSerializer(many=True, read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
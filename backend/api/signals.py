@@ -0,0 +1,142 @@
+import threading
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.db.transaction import on_commit
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Component, Ingredient, Recipe, Tag, TagRecipe
+
+from .authentication import token_data_set
+from .caching import bump_data_version, bump_data_versions, log_change
+
+User = get_user_model()
+
+# Saving these alone does not change what a user's recipes show
+USER_SERVICE_FIELDS = frozenset(
+    ('last_login', 'password', 'recipes_count', 'subscribers_count'))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    on_commit(partial(bump_data_version, 'ingredients'))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(**kwargs):
+    on_commit(partial(bump_data_version, 'tags'))
+
+
+class ChangedRecipes(threading.local):
+    """Recipes and tags changed by the transaction of this thread.
+
+    Collected ids are turned into recipe data set versions (see
+    `RecipeViewSet.response_cache_data_sets`) and an entry of the
+    `recipes` change log (see `PantryIndex`) once, on commit. Ids left
+    by a rolled back transaction only cause an extra bump later.
+    """
+
+    def __init__(self):
+        self.recipes = set()
+        self.tags = set()
+
+    def add(self, recipes=(), tags=()):
+        self.recipes.update(recipes)
+        self.tags.update(tags)
+        on_commit(self.bump)
+
+    def bump(self):
+        if not self.recipes and not self.tags:
+            return
+        recipes, self.recipes = self.recipes, set()
+        tags, self.tags = self.tags, set()
+        data_sets = {f'recipe:{pk}' for pk in recipes}
+        if recipes:
+            data_sets.add('recipes:all')
+            data_sets.update(recipe_data_sets(recipes))
+        if tags:
+            data_sets.update(
+                f'recipes:tag:{slug}' for slug
+                in Tag.objects.filter(pk__in=tags).values_list('slug',
+                                                               flat=True))
+        bump_data_versions(data_sets)
+        if recipes:
+            log_change('recipes', recipes)
+
+
+changed_recipes = ChangedRecipes()
+
+
+def recipe_data_sets(recipes):
+    data_sets = set()
+    for author, slug in Recipe.objects.filter(
+            pk__in=recipes).values_list('author', 'tags__slug'):
+        data_sets.add(f'recipes:author:{author}')
+        if slug is not None:
+            data_sets.add(f'recipes:tag:{slug}')
+    return data_sets
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, **kwargs):
+    changed_recipes.add(recipes=(instance.pk,))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    # Its tags are gone by the time the transaction commits; views have
+    # them prefetched
+    data_sets = {'recipes:all', f'recipe:{instance.pk}',
+                 f'recipes:author:{instance.author_id}',
+                 *(f'recipes:tag:{tag.slug}' for tag in instance.tags.all())}
+    on_commit(partial(bump_data_versions, data_sets))
+    on_commit(partial(log_change, 'recipes', (instance.pk,)))
+
+
+@receiver((post_save, post_delete), sender=Component)
+def component_changed(instance, **kwargs):
+    changed_recipes.add(recipes=(instance.recipe_id,))
+
+
+def components_written(recipe):
+    """What `post_save` would do for bulk written recipe components."""
+    changed_recipes.add(recipes=(recipe.pk,))
+
+
+@receiver(m2m_changed, sender=TagRecipe)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'pre_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        pk_set = TagRecipe.objects.filter(
+            **{'tag' if reverse else 'recipe': instance}).values_list(
+            'recipe' if reverse else 'tag', flat=True)
+    if reverse:
+        changed_recipes.add(recipes=pk_set, tags=(instance.pk,))
+    else:
+        changed_recipes.add(recipes=(instance.pk,), tags=pk_set)
+
+
+@receiver(post_save, sender=User)
+def author_saved(instance, update_fields=None, **kwargs):
+    if update_fields and USER_SERVICE_FIELDS.issuperset(update_fields):
+        return
+    if instance.recipes_count:
+        on_commit(partial(bump_data_version, 'recipe-authors'))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    on_commit(partial(bump_data_version, token_data_set(instance.key)))
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, update_fields=None, **kwargs):
+    # Deleting a user deletes its token, which is handled above
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    on_commit(partial(bump_data_versions, map(token_data_set, keys)))
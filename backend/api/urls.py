@@ -11,6 +11,10 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('tags', TagViewSet, basename='tags')
 
 urlpatterns = [
+    # Goes before the router, which would take `subscribe` for a user id
+    path('users/subscribe/',
+         SubscriptionViewSet.as_view({'post': 'manage_batch',
+                                      'delete': 'manage_batch'})),
     path('', include(router.urls)),
     path('users/<int:author_id>/subscribe/',
          SubscriptionViewSet.as_view({'post': 'create',
@@ -1,26 +1,135 @@
-from recipes.models import ShoppingCart
-
-
-def shopping_list(user) -> str:
-    header = 'Ингредиенты для рецептов:'
-
-    purchases = ShoppingCart.objects.filter(user=user)
-    recipes = [purchase.recipe for purchase in purchases]
-
-    purchases = dict()
-    for recipe in recipes:
-        for component in recipe.ingredients.all():
-            amount = component.amount
-            ingredient = component.ingredient
-            purchases[ingredient] = (purchases[ingredient] + amount
-                                     if ingredient in purchases else amount)
-    result = [f'{str(ingredient)} {amount} {ingredient.measurement_unit}'
-              for ingredient, amount in purchases.items()]
-    result = sorted(result)
-
-    if result:
-        width = max(map(len, result))
-        width = max(width, len(header))
-        result = [header, '=' * width] + result + ['=' * width]
-        return '\n'.join(result)
-    return 'Список покупок пуст :('
+import csv
+import json
+
+from django.db.models import BooleanField, Prefetch, Value
+from django.db.models import prefetch_related_objects
+
+from rest_framework.exceptions import ValidationError
+
+from recipes.models import Recipe, ShoppingListItem
+
+SHOPPING_LIST_HEADER = 'Ингредиенты для рецептов:'
+SHOPPING_LIST_EMPTY = 'Список покупок пуст :('
+SHOPPING_LIST_COLUMNS = ('Ингредиент', 'Единица измерения', 'Количество')
+
+
+class Echo:
+    """Pseudo-buffer for `csv.writer`: hands written rows back."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_rows(user):
+    """Yields (name, measurement_unit, amount) as rows leave the cursor."""
+    return (
+        ShoppingListItem.objects
+        .filter(user=user)
+        .values_list('ingredient__name', 'ingredient__measurement_unit',
+                     'total_amount')
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+        .iterator()
+    )
+
+
+def shopping_list_txt(rows):
+    # Header width depends on the longest line, so the text layout
+    # has to see every aggregated row (one per ingredient) first.
+    purchases = sorted(f'{name} {amount} {measurement_unit}'
+                       for name, measurement_unit, amount in rows)
+    if not purchases:
+        yield SHOPPING_LIST_EMPTY
+        return
+
+    width = max(len(SHOPPING_LIST_HEADER), *map(len, purchases))
+    yield f'{SHOPPING_LIST_HEADER}\n{"=" * width}\n'
+    for purchase in purchases:
+        yield purchase + '\n'
+    yield '=' * width
+
+
+def shopping_list_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(SHOPPING_LIST_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def shopping_list_json(rows):
+    separator = ''
+    yield '['
+    for name, measurement_unit, amount in rows:
+        yield separator + json.dumps(
+            {'name': name, 'measurement_unit': measurement_unit,
+             'amount': amount},
+            ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+SHOPPING_LIST_WRITERS = {
+    'txt': shopping_list_txt,
+    'csv': shopping_list_csv,
+    'json': shopping_list_json,
+}
+
+
+def shopping_list(user, format='txt', read_first=False):
+    """Chunks of the shopping list of `user` in `format`.
+
+    With `read_first` the rows are fetched before the first chunk, so
+    the chunks can be produced where the database is off limits.
+    """
+    writer = SHOPPING_LIST_WRITERS[format]
+    rows = shopping_list_rows(user)
+    return writer(list(rows) if read_first else rows)
+
+
+def subscribed_authors(user):
+    """Authors followed by `user`, ready for `AuthorSerializer`."""
+    return user.subscribed.annotate(
+        is_subscribed=Value(True, output_field=BooleanField()))
+
+
+def recipes_limit(request):
+    limit = request.query_params.get('recipes_limit', '')
+    return int(limit) if limit.isdigit() else None
+
+
+def pantry_ingredients(request):
+    """Ingredient ids from `?ingredients=1&ingredients=2` or `=1,2`."""
+    values = ','.join(request.query_params.getlist('ingredients'))
+    ids = [value.strip() for value in values.split(',') if value.strip()]
+    if not ids or not all(value.isdigit() for value in ids):
+        raise ValidationError(
+            {'ingredients': 'Укажите id имеющихся ингредиентов.'})
+    return [int(value) for value in ids]
+
+
+def batch_results(requested, found, changed, statuses, refused=None):
+    """Per-id outcome of a batch request, in the order ids were sent.
+
+    `statuses` name the outcome for ids in `changed` and for the other
+    found ids; `refused` maps ids to outcomes that override both.
+    """
+    done, skipped = statuses
+    refused = refused or {}
+    changed = set(changed)
+    results = []
+    for pk in requested:
+        if pk in refused:
+            outcome = refused[pk]
+        elif pk not in found:
+            outcome = 'not_found'
+        else:
+            outcome = done if pk in changed else skipped
+        results.append({'id': pk, 'status': outcome})
+    return {'results': results}
+
+
+def prefetch_author_recipes(authors, recipes_limit=None):
+    recipes = Recipe.objects.all()
+    if recipes_limit is not None:
+        recipes = recipes.filter(
+            author__in=authors).limited_per_author(recipes_limit)
+    prefetch_related_objects(authors, Prefetch('recipes', queryset=recipes))
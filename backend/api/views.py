@@ -1,165 +1,294 @@
-from io import BytesIO
+import asyncio
+from functools import partial
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, OuterRef, Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F, Prefetch
+from django.db.models.functions import Greatest
 from django.db.transaction import atomic
-from django.http import FileResponse
-from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import mixins, permissions, status, viewsets
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
 
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+from recipes.images import release_image
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, ShoppingListItem, SimilarRecipe,
                             Tag)
 from users.models import Subscription
 
-from .filters import IngredientFilterSet, RecipeFilterSet
-from .pagination import PageLimitPagination
+from .async_views import AsyncReadMixin, in_pool, load_relations
+from .authentication import CachedTokenAuthentication
+from .caching import AnonymousResponseCacheMixin, ReferenceDataCacheMixin
+from .fast_serializers import RecipeListFastSerializer
+from .filters import IngredientFilterSet, PantryFilterSet, RecipeFilterSet
+from .indexes import ingredient_index, pantry_index
+from .pagination import (CursorLimitPagination, PageLimitPagination,
+                         RecipePagination)
 from .permissions import IsActiveOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (AuthorSerializer, FavoriteRecipeSerializer,
-                          IngredientSerializer, RecipeSerializer,
-                          ShoppingCartSerializer, TagSerializer,
-                          UserSerializer)
-from .utils import shopping_list
+from .relations import RECIPE_RELATIONS, relations
+from .renderers import CSVRenderer, ORJSONRenderer, PlainTextRenderer
+from .serializers import (AuthorBatchSerializer, AuthorSerializer,
+                          FavoriteRecipeSerializer, IngredientSerializer,
+                          RecipeBatchSerializer, RecipeInListSerializer,
+                          RecipeSerializer, ShoppingCartSerializer,
+                          TagSerializer, UserSerializer)
+from .utils import (batch_results, pantry_ingredients,
+                    prefetch_author_recipes, recipes_limit, shopping_list,
+                    subscribed_authors)
 
 User = get_user_model()
 
 
 class SubscriptionViewSet(mixins.CreateModelMixin, mixins.DestroyModelMixin,
                           viewsets.GenericViewSet):
-    authentication_classes = (TokenAuthentication,)
-    permission_classes = (IsActiveOrReadOnly,)
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated & IsActiveOrReadOnly,)
 
+    @atomic
     def create(self, request, *args, **kwargs):
         author = get_object_or_404(User, pk=kwargs['author_id'])
         subscriber = request.user
-        subscribed = Subscription.objects.filter(
-            subscriber=subscriber, author=author).exists()
-
         if author == subscriber:
             return Response('Нельзя подписаться на самого себя.',
                             status=status.HTTP_400_BAD_REQUEST)
-        if subscribed:
+        if not Subscription.objects.link(subscriber, (author.pk,)):
             return Response('Вы уже подписаны на этого автора.',
                             status=status.HTTP_400_BAD_REQUEST)
 
-        subscriber.subscribed.add(author)
+        FeedEntry.objects.follow(subscriber, (author.pk,))
+        relations.changed(subscriber, 'subscriptions')
+        author = subscribed_authors(subscriber).get(pk=author.pk)
+        prefetch_author_recipes((author,), recipes_limit(request))
         serializer = AuthorSerializer(author)
         serializer.context['request'] = self.request
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @atomic
     def destroy(self, request, *args, **kwargs):
         author = get_object_or_404(User, pk=kwargs['author_id'])
         subscriber = request.user
-        subscribed = Subscription.objects.filter(
-            subscriber=subscriber, author=author).exists()
-
-        if not subscribed:
+        if not Subscription.objects.unlink(subscriber, (author.pk,)):
             return Response(
                 'Вы не подписаны на данного автора.',
                 status=status.HTTP_400_BAD_REQUEST)
 
-        subscriber.subscribed.remove(author)
+        FeedEntry.objects.unfollow(subscriber, (author.pk,))
+        relations.changed(subscriber, 'subscriptions')
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @atomic
+    def manage_batch(self, request, *args, **kwargs):
+        batch = AuthorBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        requested = list(dict.fromkeys(batch.validated_data['authors']))
+        subscriber = request.user
+        found = set(User.objects.filter(
+            pk__in=requested).values_list('pk', flat=True))
+        found.discard(subscriber.pk)
+        authors = [pk for pk in requested if pk in found]
 
-class UserViewSet(DjoserUserViewSet):
-    authentication_classes = (TokenAuthentication,)
+        if request.method == 'POST':
+            changed = Subscription.objects.link(subscriber, authors)
+            FeedEntry.objects.follow(subscriber, changed)
+            relations.changed(subscriber, 'subscriptions')
+            statuses = ('added', 'exists')
+        else:
+            changed = Subscription.objects.unlink(subscriber, authors)
+            FeedEntry.objects.unfollow(subscriber, changed)
+            relations.changed(subscriber, 'subscriptions')
+            statuses = ('removed', 'absent')
+        return Response(batch_results(requested, found, changed, statuses,
+                                      refused={subscriber.pk: 'self'}))
+
+
+class UserViewSet(AsyncReadMixin, DjoserUserViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     serializer_class = UserSerializer
     pagination_class = PageLimitPagination
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_authenticated:
-            subscription = Subscription.objects.filter(
-                author=OuterRef('pk'), subscriber=user)
-            return User.objects.annotate(is_subscribed=Exists(subscription))
         return User.objects.all()
 
+    def get_serializer(self, *args, **kwargs):
+        if args and self.action in ('list', 'retrieve'):
+            users = args[0] if kwargs.get('many') else (args[0],)
+            relations.mark_users(self.request.user, users)
+        return super().get_serializer(*args, **kwargs)
+
     @action(methods=('GET',), detail=False,
-            authentication_classes=(TokenAuthentication,),
+            authentication_classes=(CachedTokenAuthentication,),
             permission_classes=(permissions.IsAuthenticated,),
             serializer_class=AuthorSerializer,
             pagination_class=PageLimitPagination)
     def subscriptions(self, request):
-        subscriptions = request.user.subscribed.all()
+        subscriptions = subscribed_authors(request.user)
         page = self.paginate_queryset(subscriptions)
+        prefetch_author_recipes(page, recipes_limit(request))
 
         serializer = self.get_serializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AsyncReadMixin, ReferenceDataCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
+    authentication_classes = ()
+    reference_data = 'ingredients'
+
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilterSet
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return self.cached_response(
+                request, lambda: Response(ingredient_index.search(name)))
+        return super().list(request, *args, **kwargs)
 
-class TagViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin,
+
+class TagViewSet(AsyncReadMixin, ReferenceDataCacheMixin,
+                 mixins.ListModelMixin, mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
+    authentication_classes = ()
+    reference_data = 'tags'
+
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    authentication_classes = (TokenAuthentication,)
+class RecipeViewSet(AsyncReadMixin, AnonymousResponseCacheMixin,
+                    viewsets.ModelViewSet):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthorOrReadOnly & IsActiveOrReadOnly,)
 
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
-    pagination_class = PageLimitPagination
+    pagination_class = RecipePagination
 
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilterSet
+    renderer_classes = (ORJSONRenderer, BrowsableAPIRenderer)
+    # Versions bumped by `api.signals` when the recipes change
+    response_cache_data = ('tags', 'ingredients', 'recipe-authors')
+
+    relation_sets = None  # Preloaded by the async actions
 
-    @atomic
     def get_queryset(self):
-        queryset = (
+        return (
             Recipe.objects
-            .prefetch_related('ingredients', 'ingredients__ingredient')
+            .select_related('author')
+            .prefetch_related(Prefetch('tags', Tag.objects.order_by('pk')),
+                              'ingredients', 'ingredients__ingredient')
         )
 
-        user = self.request.user
-        if user.is_authenticated:
-            favorites = FavoriteRecipe.objects.filter(
-                recipe=OuterRef('pk'), user=user)
-            shopping_cart = ShoppingCart.objects.filter(
-                recipe=OuterRef('pk'), user=user)
-            subscription = Subscription.objects.filter(
-                author_id=OuterRef('id'), subscriber=user)
-            return (
-                queryset
-                .annotate(is_favorited=Exists(favorites),
-                          is_in_shopping_cart=Exists(shopping_cart))
-                .prefetch_related(
-                    Prefetch(
-                        'author',
-                        User.objects.annotate(
-                            is_subscribed=Exists(subscription))
-                    )
-                )
-            )
-        return queryset.select_related('author')
+    def get_serializer(self, *args, **kwargs):
+        if args:
+            recipes = args[0] if kwargs.get('many') else (args[0],)
+            relations.mark_recipes(self.request.user, recipes,
+                                   self.relation_sets)
+        return super().get_serializer(*args, **kwargs)
+
+    def fast_list(self):
+        return settings.REST_FRAMEWORK.get('RECIPE_LIST_FAST_PATH', True)
+
+    def list_page(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.fast_list():
+            queryset = queryset.prefetch_related(None).values(
+                *RecipeListFastSerializer.fields)
+        return self.paginate_queryset(queryset)
+
+    def list_serializer(self, page):
+        if self.fast_list():
+            return RecipeListFastSerializer(page, self.request,
+                                            self.relation_sets)
+        return self.get_serializer(page, many=True)
+
+    def response_cache_data_sets(self):
+        data_sets = self.response_cache_data
+        if self.action == 'retrieve':
+            return [*data_sets, f'recipe:{self.kwargs["pk"]}']
+        params = self.request.query_params
+        # A filtered page can only change with recipes that match it
+        filtered = [f'recipes:tag:{slug}' for slug in params.getlist('tags')]
+        author = params.get('author')
+        if author is not None:
+            if not author.isdigit():
+                return None
+            filtered.append(f'recipes:author:{int(author)}')
+        return [*data_sets, *(filtered or ['recipes:all'])]
+
+    def list(self, request, *args, **kwargs):
+        return self.anonymous_cached(request, self.list_response)
+
+    def list_response(self):
+        serializer = self.list_serializer(self.list_page())
+        return self.get_paginated_response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.anonymous_cached(
+            request, partial(super().retrieve, request, *args, **kwargs))
+
+    async def async_list(self, request, *args, **kwargs):
+        return await self.async_anonymous_cached(request,
+                                                 self.async_list_response)
+
+    async def async_list_response(self):
+        page, self.relation_sets = await asyncio.gather(
+            in_pool(self.list_page),
+            load_relations(self.request.user, RECIPE_RELATIONS))
+        serializer = self.list_serializer(page)
+        data = await in_pool(getattr, serializer, 'data')
+        return self.get_paginated_response(data)
+
+    async def async_retrieve(self, request, *args, **kwargs):
+        return await self.async_anonymous_cached(
+            request, self.async_retrieve_response)
+
+    async def async_retrieve_response(self):
+        instance, self.relation_sets = await asyncio.gather(
+            in_pool(self.get_object),
+            load_relations(self.request.user, RECIPE_RELATIONS))
+        serializer = self.get_serializer(instance)
+        return Response(await in_pool(getattr, serializer, 'data'))
+
+    @atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.discard_recipe(instance)
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=Greatest(F('recipes_count') - 1, 0))
+        instance.delete()
+        release_image(instance.image.name, instance.image_variants)
 
+    @atomic
     def __manage_list(self, request, obj_id,
-                      serializer_class, linking_model=None):
+                      serializer_class, linking_model, relation):
         data = {'user': request.user.id, 'recipe': obj_id}
         link = serializer_class(data=data)
 
         if request.method == 'POST':
             link.is_valid(raise_exception=True)
-            link.save()
-            return Response(link.data, status=status.HTTP_201_CREATED)
+            if not linking_model.objects.link(request.user, (obj_id,)):
+                # Added by a concurrent request; validation now says so
+                serializer_class(data=data).is_valid(raise_exception=True)
+            relations.changed(request.user, relation)
+            return Response(
+                RecipeInListSerializer(link.validated_data['recipe']).data,
+                status=status.HTTP_201_CREATED)
 
-        link_count, _ = linking_model.objects.filter(**data).delete()
-        if link_count:
+        if linking_model.objects.unlink(request.user, (obj_id,)):
+            relations.changed(request.user, relation)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response('Рецепт не в списке',
                         status=status.HTTP_400_BAD_REQUEST)
@@ -168,19 +297,121 @@ class RecipeViewSet(viewsets.ModelViewSet):
             permission_classes=(IsActiveOrReadOnly,))
     def favorite(self, request, pk=None):
         return self.__manage_list(request, self.get_object().id,
-                                  FavoriteRecipeSerializer, FavoriteRecipe)
+                                  FavoriteRecipeSerializer, FavoriteRecipe,
+                                  'favorites')
 
     @action(methods=('POST', 'DELETE'), detail=True,
             permission_classes=(IsActiveOrReadOnly,))
     def shopping_cart(self, request, pk=None):
         return self.__manage_list(request, self.get_object().id,
-                                  ShoppingCartSerializer, ShoppingCart)
+                                  ShoppingCartSerializer, ShoppingCart,
+                                  'shopping_cart')
+
+    @atomic
+    def __manage_lists(self, request, linking_model, relation):
+        batch = RecipeBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        requested = list(dict.fromkeys(batch.validated_data['recipes']))
+        found = set(Recipe.objects.filter(
+            pk__in=requested).values_list('pk', flat=True))
+        recipes = [pk for pk in requested if pk in found]
+
+        if request.method == 'POST':
+            changed = linking_model.objects.link(request.user, recipes)
+            relations.changed(request.user, relation)
+            statuses = ('added', 'exists')
+        else:
+            changed = linking_model.objects.unlink(request.user, recipes)
+            relations.changed(request.user, relation)
+            statuses = ('removed', 'absent')
+        return Response(batch_results(requested, found, changed, statuses))
+
+    @action(methods=('POST', 'DELETE'), detail=False, url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=(permissions.IsAuthenticated
+                                & IsActiveOrReadOnly,))
+    def favorite_batch(self, request):
+        return self.__manage_lists(request, FavoriteRecipe, 'favorites')
+
+    @action(methods=('POST', 'DELETE'), detail=False,
+            url_path='shopping_cart', url_name='shopping-cart-batch',
+            permission_classes=(permissions.IsAuthenticated
+                                & IsActiveOrReadOnly,))
+    def shopping_cart_batch(self, request):
+        return self.__manage_lists(request, ShoppingCart, 'shopping_cart')
 
     @action(methods=('GET',), detail=False,
-            permission_classes=(permissions.IsAuthenticated,),)
-    def download_shopping_cart(self, request):
-        filename = 'Shopping cart.txt'
+            pagination_class=PageLimitPagination)
+    def cook(self, request):
+        params = request.query_params
+        filterset = PantryFilterSet(params, request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        tags = [tag.pk for tag in filterset.form.cleaned_data['tags']]
+        author = params.get('author', '')
+        recipes = None
+        if request.user.is_authenticated:
+            for param, relation in (('is_favorited', 'favorites'),
+                                    ('is_in_shopping_cart', 'shopping_cart')):
+                if params.get(param) in ('1', 'true', 'True'):
+                    listed = relations.get(request.user, relation)
+                    recipes = listed if recipes is None else recipes & listed
+
+        found = pantry_index.search(
+            pantry_ingredients(request), tags=tags,
+            author=int(author) if author.isdigit() else None,
+            recipes=recipes)
+        page = self.paginate_queryset(found)
+        by_id = self.get_queryset().in_bulk(
+            [recipe for recipe, _, _ in page])
+        page = [item for item in page if item[0] in by_id]
+
+        serializer = self.get_serializer(
+            [by_id[recipe] for recipe, _, _ in page], many=True)
+        data = serializer.data
+        for recipe, (_, available, missing) in zip(data, page):
+            recipe['ingredients_available'] = available
+            recipe['ingredients_missing'] = missing
+        return self.get_paginated_response(data)
+
+    @action(methods=('GET',), detail=True)
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe, pk=pk)
+        similar = (
+            SimilarRecipe.objects
+            .filter(recipe=recipe)
+            .select_related('similar')
+            .order_by('-score')
+        )
+        serializer = RecipeInListSerializer(
+            [entry.similar for entry in similar], many=True,
+            context=self.get_serializer_context())
+        return Response(serializer.data)
 
-        purchases = shopping_list(request.user)
-        return FileResponse(BytesIO(purchases.encode()),
-                            filename=filename, as_attachment=True)
+    @action(methods=('GET',), detail=False,
+            permission_classes=(permissions.IsAuthenticated,),
+            pagination_class=CursorLimitPagination)
+    def feed(self, request):
+        recipes = FeedEntry.objects.feed(
+            request.user, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=('GET',), detail=False,
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer))
+    def download_shopping_cart(self, request):
+        renderer = request.accepted_renderer
+        filename = f'Shopping cart.{renderer.format}'
+
+        # Django 3.2 iterates streaming content of ASGI responses on the
+        # event loop, where the database is off limits
+        purchases = shopping_list(
+            request.user, renderer.format,
+            read_first=isinstance(request._request, ASGIRequest))
+        response = StreamingHttpResponse(
+            (chunk.encode() for chunk in purchases),
+            content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -3,5 +3,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'on')
+# Async views query from a fixed pool of threads: keep their connections
+os.environ.setdefault('DB_CONN_MAX_AGE', '60')
 
 application = get_asgi_application()
@@ -17,6 +17,7 @@ DJANGO_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 THIRD_PARTY_APPS = [
     'rest_framework',
@@ -36,6 +37,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.QueryInspectionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -72,7 +74,8 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=0)),
     }
 }
 
@@ -112,14 +115,125 @@ STATIC_ROOT = BASE_DIR / 'static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ),
-    'PAGELIMITPAGINATION_PAGE_SIZE': 6
+    'PAGELIMITPAGINATION_PAGE_SIZE': 6,
+    'RECIPE_PAGINATION': os.getenv('RECIPE_PAGINATION', 'page'),
+    'RECIPE_LIST_FAST_PATH': os.getenv('RECIPE_LIST_FAST_PATH',
+                                       'on') == 'on',
 }
 
 AUTH_USER_MODEL = 'users.User'
+
+# Data set versions in the cache invalidate the caches of every worker
+# and of management commands (`loaddata`), so all of them have to share
+# it. The database table is made by `migrate`; infra runs Memcached.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='django_cache'),
+    }
+}
+
+# api.relations.LocMemBackend keeps the sets in process memory and
+# only their versions in the cache; OPTIONS can set its max_entries
+RELATIONS_CACHE = {
+    'BACKEND': os.getenv('RELATIONS_CACHE_BACKEND',
+                         default='api.relations.CacheBackend'),
+    'TIMEOUT': 10 * 60,
+}
+
+FEED = {
+    'FAN_OUT_LIMIT': 10000,
+    # Lower than the limit, so that an author hovering around it does not
+    # switch between the two ways of filling feeds
+    'FAN_OUT_RESUME': 9000,
+    'BATCH_SIZE': 1000,
+}
+
+SIMILAR_RECIPES = {
+    'TOP_K': 10,
+    'TAG_WEIGHT': 0.25,
+    'MAX_INGREDIENT_SHARE': 0.1,
+    # Recipes compared with an edited one when its list is refreshed
+    'MAX_CANDIDATES': 1000,
+}
+
+# Uploads are limited; smaller copies are made in background threads
+IMAGE_VARIANTS = {
+    'ENABLED': os.getenv('IMAGE_VARIANTS', 'on') == 'on',
+    'MAX_WORKERS': int(os.getenv('IMAGE_VARIANTS_MAX_WORKERS', default=2)),
+    'MAX_UPLOAD_SIZE': 5 * 1024 * 1024,
+    'MAX_PIXELS': 40_000_000,
+    # Longest side fits the box; formats Pillow cannot write are skipped
+    'SIZES': {'thumbnail': (480, 480), 'medium': (1200, 1200)},
+    'FORMATS': ('webp', 'avif'),
+    'QUALITY': 80,
+}
+
+# Unreferenced media files are deleted once they are this old (seconds):
+# a file shared by an upload in progress is not referenced yet
+MEDIA_GC = {
+    'GRACE_PERIOD': 60 * 60,
+    'BATCH_SIZE': 500,
+}
+
+# Read views served from coroutines; `backend.asgi` switches them on
+ASYNC_VIEWS = {
+    'ENABLED': os.getenv('ASYNC_VIEWS', 'off') == 'on',
+    'MAX_WORKERS': int(os.getenv('ASYNC_VIEWS_MAX_WORKERS', default=8)),
+}
+
+BATCH_MUTATIONS = {
+    'MAX_ITEMS': 100,
+}
+
+REFERENCE_DATA_CACHE = {
+    'MAX_AGE': 60,
+    'TIMEOUT': 24 * 60 * 60,
+}
+
+# Users of recently seen tokens, kept by each process for safe methods.
+# A hit still reads the token version from the default cache, so it
+# saves queries only with a cache outside the database, like Memcached:
+# with DatabaseCache the version read is a query itself
+TOKEN_AUTH_CACHE = {
+    'ENABLED': os.getenv('TOKEN_AUTH_CACHE', 'on') == 'on',
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 5 * 60,
+}
+
+# Whole responses to anonymous recipe requests
+RESPONSE_CACHE = {
+    'ENABLED': os.getenv('RESPONSE_CACHE', 'on') == 'on',
+    'TIMEOUT': 10 * 60,
+}
+
+SQL_INSPECTION = {
+    'ENABLED': os.getenv('SQL_INSPECTION', 'on') == 'on',
+    'DUPLICATE_THRESHOLD': 5,
+    'RAISE': os.getenv('SQL_INSPECTION_RAISE', 'off') == 'on',
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.sql': {
+            'handlers': ['console'],
+            'level': os.getenv('SQL_INSPECTION_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
@@ -1,18 +1,26 @@
 from django.contrib import admin
 
 from .models import (Component, FavoriteRecipe, Ingredient, Recipe,
-                     ShoppingCart, Tag, TagRecipe)
+                     ShoppingCart, ShoppingListItem, Tag, TagRecipe)
+from .search import search_recipes
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author')
-    search_fields = ('name__icontains', 'tags__name',
-                     'author__first_name', 'author__last_name')
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count')
+    search_fields = ('tags__name', 'author__first_name', 'author__last_name')
     readonly_fields = ('favourited',)
 
+    def get_search_results(self, request, queryset, search_term):
+        found, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term)
+        if search_term:
+            matched = search_recipes(queryset, search_term).values('pk')
+            found |= queryset.filter(pk__in=matched)
+        return found, may_have_duplicates
+
     def favourited(self, obj):
-        return obj.favorited_by.all().count()
+        return obj.favorites_count
 
 
 @admin.register(Ingredient)
@@ -44,3 +52,9 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    readonly_fields = ('user', 'ingredient', 'total_amount')
@@ -0,0 +1,50 @@
+from django.apps import apps as global_apps
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# (model, counter field, counted model, its foreign key to the model)
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'recipes.FavoriteRecipe',
+     'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'recipes.ShoppingCart', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'subscribers_count', 'users.Subscription', 'author'),
+)
+
+
+def actual_count(apps, counted, foreign_key):
+    rows = (
+        apps.get_model(counted)._base_manager
+        .filter(**{foreign_key: OuterRef('pk')})
+        .order_by()
+        .values(foreign_key)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+def reconcile_counters(apps=global_apps, fix=True, batch_size=1000):
+    """Finds counters that drifted from the rows they count.
+
+    Returns `{(model, field): drifted rows}`; with `fix` the drifted
+    counters are set to the actual counts.
+    """
+    drift = {}
+    for model_name, field, counted, foreign_key in COUNTERS:
+        model = apps.get_model(model_name)
+        actual = actual_count(apps, counted, foreign_key)
+        drifted = list(
+            model._base_manager
+            .annotate(actual=actual)
+            .exclude(**{field: F('actual')})
+            .values_list('pk', flat=True))
+        drift[model_name, field] = len(drifted)
+        if fix:
+            for start in range(0, len(drifted), batch_size):
+                (
+                    model._base_manager
+                    .filter(pk__in=drifted[start:start + batch_size])
+                    .update(**{field: actual})
+                )
+    return drift
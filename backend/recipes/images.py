@@ -0,0 +1,193 @@
+import logging
+import os
+import posixpath
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+VARIANTS_DIR = 'recipes/images/variants/'
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_VARIANTS['MAX_WORKERS'],
+    thread_name_prefix='image-variants')
+
+
+def storage():
+    return Recipe._meta.get_field('image').storage
+
+
+def variant_formats():
+    """Configured formats this build of Pillow can write."""
+    Image.init()
+    return [image_format for image_format in settings.IMAGE_VARIANTS['FORMATS']
+            if image_format.upper() in Image.SAVE]
+
+
+def build_variants(name):
+    """Saves resized copies of image file `name`; returns their names.
+
+    Copies go to a directory named after the original, so garbage
+    collection can tell whose they are.
+    """
+    options = settings.IMAGE_VARIANTS
+    formats = variant_formats()
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {}
+    with storage().open(name) as file, Image.open(file) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = (image.mode in ('RGBA', 'LA', 'PA')
+                     or 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        for size, box in options['SIZES'].items():
+            resized = image.copy()
+            resized.thumbnail(box, Image.LANCZOS)  # Never enlarges
+            for image_format in formats:
+                buffer = BytesIO()
+                resized.save(buffer, image_format.upper(),
+                             quality=options['QUALITY'])
+                variants[f'{size}_{image_format}'] = storage().save(
+                    f'{VARIANTS_DIR}{stem}/{size}.{image_format}',
+                    ContentFile(buffer.getvalue()))
+    return variants
+
+
+def release_image(name, variants):
+    """Deletes an image and its variants once the transaction commits.
+
+    Files still used by a recipe or saved during the grace period, maybe
+    by an upload not yet committed, are left to `collect_media_garbage`.
+    """
+    if name:
+        on_commit(partial(_release_image, name, variants))
+
+
+def _release_image(name, variants):
+    grace_start = timezone.now() - timedelta(
+        seconds=settings.MEDIA_GC['GRACE_PERIOD'])
+    if (Recipe.objects.filter(image=name).exists()
+            or not storage().exists(name)
+            or storage().get_modified_time(name) >= grace_start):
+        return
+    for file in (name, *variants.values()):
+        storage().delete(file)
+
+
+def refresh_variants(recipe_id, image):
+    """Builds variants of `image` for the recipe, unless it was replaced.
+
+    Runs on the worker pool, so failures are logged, not raised.
+    """
+    close_old_connections()
+    try:
+        variants = build_variants(image)
+        with atomic():
+            recipe = (Recipe.objects.select_for_update()
+                      .filter(pk=recipe_id, image=image).first())
+            if recipe is not None:
+                recipe.image_variants = variants
+                recipe.save(update_fields=('image_variants',))
+        # Variants of a replaced image may be shared; left to collection
+    except Exception:
+        logger.exception('Не удалось сделать варианты картинки %s', image)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe):
+    """Builds the image variants of `recipe` once the transaction commits.
+
+    Until then the recipe has none, and clients show the original.
+    """
+    if settings.IMAGE_VARIANTS['ENABLED'] and recipe.image:
+        on_commit(partial(executor.submit, refresh_variants, recipe.pk,
+                          recipe.image.name))
+
+
+def collect_garbage(delete=True):
+    """Finds recipe images and variants no recipe refers to.
+
+    Streams the media directories and checks them against the database
+    a batch at a time, so memory does not grow with the number of files.
+    Files younger than `MEDIA_GC['GRACE_PERIOD']` are kept: they may
+    belong to uploads not yet committed. Returns the numbers of unused
+    images and variant sets, which are deleted unless `delete` is off.
+    """
+    grace_start = time.time() - settings.MEDIA_GC['GRACE_PERIOD']
+    upload_to = Recipe._meta.get_field('image').upload_to
+
+    images = 0
+    originals = (entry for entry in _scan(upload_to)
+                 if entry.is_file() and entry.stat().st_mtime < grace_start)
+    for batch in _batches(originals):
+        names = {upload_to + entry.name for entry in batch}
+        used = Recipe.objects.filter(image__in=names).values_list(
+            'image', flat=True)
+        for name in names.difference(used):
+            images += 1
+            if delete:
+                storage().delete(name)
+
+    variant_sets = 0
+    for batch in _batches(_scan(VARIANTS_DIR)):
+        owners = {}
+        for entry in batch:
+            # Older variants lie next to each other as {stem}_{size}.ext
+            stem = (entry.name if entry.is_dir()
+                    else entry.name.rsplit('_', 1)[0])
+            owners.setdefault(stem, []).append(entry)
+        pattern = '^{}({})\\.'.format(
+            re.escape(upload_to), '|'.join(map(re.escape, owners)))
+        used = {
+            posixpath.splitext(posixpath.basename(name))[0]
+            for name in Recipe.objects.filter(
+                image__regex=pattern).values_list('image', flat=True)}
+        for stem in owners.keys() - used:
+            variant_sets += 1
+            if delete:
+                for entry in owners[stem]:
+                    _delete_entry(entry, grace_start)
+    return images, variant_sets
+
+
+def _scan(directory):
+    path = storage().path(directory)
+    if os.path.isdir(path):
+        with os.scandir(path) as entries:
+            yield from entries
+
+
+def _batches(entries):
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.MEDIA_GC['BATCH_SIZE']))
+        if not batch:
+            return
+        yield batch
+
+
+def _delete_entry(entry, grace_start):
+    if not entry.is_dir():
+        if entry.stat().st_mtime < grace_start:
+            os.remove(entry.path)
+        return
+    with os.scandir(entry.path) as files:
+        for file in files:
+            if file.stat().st_mtime < grace_start:
+                os.remove(file.path)
+    if not os.listdir(entry.path):
+        os.rmdir(entry.path)
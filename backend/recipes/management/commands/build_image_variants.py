@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import executor, refresh_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Делает уменьшенные копии картинок рецептов, у которых их ещё '
+            'нет (или у всех рецептов с --all).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='rebuild',
+                            help='Пересоздать копии у всех рецептов.')
+
+    def handle(self, *args, rebuild, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not rebuild:
+            recipes = recipes.filter(image_variants={})
+        jobs = [executor.submit(refresh_variants, pk, image)
+                for pk, image in recipes.values_list('pk', 'image')]
+        for job in jobs:
+            job.result()
+        done = Recipe.objects.exclude(image_variants={}).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {len(jobs)}; с копиями рецептов: '
+            f'{done}.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from recipes.models import SimilarRecipe
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки похожих рецептов для всех рецептов.'
+
+    def handle(self, *args, **options):
+        with atomic():
+            SimilarRecipe.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Похожие рецепты пересчитаны: {SimilarRecipe.objects.count()} '
+            f'связей.'))
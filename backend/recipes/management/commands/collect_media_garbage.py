@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import collect_garbage
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из MEDIA_ROOT картинки рецептов и их уменьшенные '
+            'копии, на которые не ссылается ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать, ничего не удаляя.')
+
+    def handle(self, *args, dry_run, **options):
+        images, variant_sets = collect_garbage(delete=not dry_run)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Найдено" if dry_run else "Удалено"} неиспользуемых картинок: '
+            f'{images}, наборов копий: {variant_sets}.'))
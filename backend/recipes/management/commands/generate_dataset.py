@@ -0,0 +1,159 @@
+import base64
+import random
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.transaction import atomic
+
+from recipes.counters import reconcile_counters
+from recipes.models import (Component, FavoriteRecipe, FeedEntry, Ingredient,
+                            Recipe, ShoppingCart, ShoppingListItem,
+                            SimilarRecipe, Tag, TagRecipe)
+from users.models import Subscription
+
+User = get_user_model()
+
+IMAGE = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAF'
+    'BQIAX8jx0gAAAABJRU5ErkJggg==')
+PASSWORD = 'dataset-password'
+WORDS = ('суп', 'пирог', 'салат', 'рагу', 'запеканка', 'паста', 'каша',
+         'омлет', 'котлеты', 'плов', 'блины', 'кекс', 'соус', 'борщ')
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетический набор данных для замеров: '
+            'пользователей, рецепты, избранное, корзины и подписки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='В среднем избранных рецептов '
+                                 'на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='В среднем рецептов в корзине.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='В среднем подписок на пользователя.')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.ingredients = list(Ingredient.objects.values_list('pk',
+                                                               flat=True))
+        self.tags = list(Tag.objects.values_list('pk', flat=True))
+        if not self.ingredients or not self.tags:
+            raise CommandError('Сначала загрузите ингредиенты и тэги.')
+
+        with atomic():
+            users = self.create_users(options['users'])
+            # Popular authors and recipes collect most of the attention.
+            author_weights = self.popularity(len(users))
+            recipes = self.create_recipes(users, author_weights,
+                                          options['recipes'])
+            recipe_weights = self.popularity(len(recipes))
+            self.create_links(
+                Subscription, users, 'subscriber', users, 'author',
+                author_weights, options['subscriptions'])
+            self.create_links(
+                FavoriteRecipe, users, 'user', [pk for pk, _ in recipes],
+                'recipe', recipe_weights, options['favorites'])
+            self.create_links(
+                ShoppingCart, users, 'user', [pk for pk, _ in recipes],
+                'recipe', recipe_weights, options['cart'])
+            for start in range(0, len(users), self.batch_size):
+                ShoppingListItem.objects.rebuild(
+                    users[start:start + self.batch_size])
+            reconcile_counters()  # bulk_create bypasses the list hooks
+            for start in range(0, len(users), self.batch_size):
+                FeedEntry.objects.rebuild(
+                    users[start:start + self.batch_size])
+            SimilarRecipe.objects.rebuild()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {len(recipes)}.'))
+
+    def create_users(self, count):
+        run = uuid.uuid4().hex[:8]
+        password = make_password(PASSWORD)
+        self.bulk_create(
+            User(email=f'dataset-{run}-{number}@example.com',
+                 username=f'dataset-{run}-{number}',
+                 first_name=f'Имя{number}', last_name=f'Фамилия{number}',
+                 password=password)
+            for number in range(count))
+        return list(
+            User.objects.filter(username__startswith=f'dataset-{run}-')
+            .order_by('pk').values_list('pk', flat=True))
+
+    def create_recipes(self, users, weights, count):
+        image = 'recipes/images/dataset.png'
+        if not default_storage.exists(image):
+            image = default_storage.save(image, ContentFile(IMAGE))
+        authors = self.random.choices(users, weights, k=count)
+        self.bulk_create(
+            Recipe(author_id=author,
+                   name=f'{self.random.choice(WORDS).capitalize()} '
+                        f'№{number}',
+                   text=' '.join(self.random.choices(WORDS, k=30)),
+                   image=image,
+                   cooking_time=self.random.randint(5, 180))
+            for number, author in enumerate(authors))
+        recipes = list(
+            Recipe.objects.filter(author__in=users)
+            .order_by('pk').values_list('pk', 'author'))
+
+        self.bulk_create(
+            Component(recipe_id=recipe, ingredient_id=ingredient,
+                      amount=self.random.randint(1, 500))
+            for recipe, _ in recipes
+            for ingredient in self.random.sample(
+                self.ingredients,
+                min(self.random.randint(3, 12), len(self.ingredients))))
+        self.bulk_create(
+            TagRecipe(recipe_id=recipe, tag_id=tag)
+            for recipe, _ in recipes
+            for tag in self.random.sample(
+                self.tags, min(self.random.randint(1, 3), len(self.tags))))
+        return recipes
+
+    def create_links(self, model, owners, owner_field, targets, target_field,
+                     weights, average):
+        if not targets:
+            return
+
+        def links():
+            for owner in owners:
+                count = min(int(self.random.expovariate(1 / average)),
+                            len(targets)) if average else 0
+                chosen = set(self.random.choices(targets, weights, k=count))
+                if model is Subscription:
+                    chosen.discard(owner)
+                for target in chosen:
+                    yield model(**{f'{owner_field}_id': owner,
+                                   f'{target_field}_id': target})
+
+        self.bulk_create(links())
+
+    def popularity(self, count):
+        """Zipf-like weights: the n-th item is n times less popular."""
+        order = list(range(1, count + 1))
+        self.random.shuffle(order)
+        return [1 / rank for rank in order]
+
+    def bulk_create(self, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batch_size:
+                type(obj).objects.bulk_create(batch)
+                batch = []
+        if batch:
+            type(batch[0]).objects.bulk_create(batch)
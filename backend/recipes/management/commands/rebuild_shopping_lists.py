@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.transaction import atomic
+
+from recipes.models import ShoppingListItem
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает списки покупок из корзин пользователей '
+            'или проверяет их расхождение с корзинами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить, ничего не меняя.')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Пользователей за один проход.')
+
+    def handle(self, *args, verify, batch_size, **options):
+        drifted = 0
+        for users in self.user_batches(batch_size):
+            if verify:
+                drifted += self.verify(users)
+            else:
+                with atomic():
+                    ShoppingListItem.objects.rebuild(users)
+
+        if verify and drifted:
+            raise CommandError(f'Расхождений в списках покупок: {drifted}')
+        self.stdout.write(self.style.SUCCESS(
+            'Списки покупок сходятся с корзинами.' if verify
+            else 'Списки покупок пересобраны.'))
+
+    def verify(self, users):
+        expected = ShoppingListItem.objects.compute(users)
+        stored = ShoppingListItem.objects.stored(users)
+        drifted = 0
+        for user, ingredient in sorted(expected.keys() | stored.keys()):
+            should_be = expected.get((user, ingredient))
+            found = stored.get((user, ingredient))
+            if should_be != found:
+                drifted += 1
+                self.stdout.write(
+                    f'Пользователь {user}, ингредиент {ingredient}: '
+                    f'ожидалось {should_be}, записано {found}')
+        return drifted
+
+    def user_batches(self, batch_size):
+        users = User.objects.order_by('pk').values_list('pk', flat=True)
+        batch = []
+        for user in users.iterator():
+            batch.append(user)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
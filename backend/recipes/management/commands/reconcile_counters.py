@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.transaction import atomic
+
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики избранного, корзин, рецептов и подписчиков '
+            'с данными и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить, ничего не меняя.')
+
+    def handle(self, *args, verify, **options):
+        with atomic():
+            drift = reconcile_counters(fix=not verify)
+
+        drifted = 0
+        for (model, field), rows in drift.items():
+            if rows:
+                drifted += rows
+                self.stdout.write(f'{model}.{field}: расхождений {rows}')
+
+        if verify and drifted:
+            raise CommandError(f'Расхождений в счётчиках: {drifted}')
+        self.stdout.write(self.style.SUCCESS(
+            'Счётчики сходятся с данными.' if verify or not drifted
+            else 'Счётчики исправлены.'))
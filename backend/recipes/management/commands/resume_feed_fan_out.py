@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = ('Снова раскладывает рецепты по лентам подписчиков для авторов, '
+            'у которых подписчиков стало не больше FEED["FAN_OUT_RESUME"]. '
+            'Запускайте по расписанию, например раз в час.')
+
+    def handle(self, *args, **options):
+        resumed = FeedEntry.objects.resume_fan_out()
+        self.stdout.write(self.style.SUCCESS(
+            f'Ленты заполнены для авторов: {resumed}.'))
@@ -0,0 +1,64 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+from recipes.search import FTS_TABLE, FTS_TRIGGERS
+
+SEARCH_INDEXES = (
+    GinIndex(SearchVector('name', weight='A', config='russian')
+             + SearchVector('text', weight='B', config='russian'),
+             name='recipe_search_vector_idx'),
+    GinIndex(fields=('name',), opclasses=('gin_trgm_ops',),
+             name='recipe_name_trigram_idx'),
+)
+
+SQLITE_FTS = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    f"name, text, content='recipes_recipe', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')",
+    *FTS_TRIGGERS,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+SQLITE_FTS_DROP = (
+    f'DROP TRIGGER {FTS_TABLE}_insert',
+    f'DROP TRIGGER {FTS_TABLE}_delete',
+    f'DROP TRIGGER {FTS_TABLE}_update',
+    f'DROP TABLE {FTS_TABLE}',
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        Recipe = apps.get_model('recipes', 'Recipe')
+        for index in SEARCH_INDEXES:
+            schema_editor.add_index(Recipe, index)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_FTS:
+            schema_editor.execute(statement)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        Recipe = apps.get_model('recipes', 'Recipe')
+        for index in SEARCH_INDEXES:
+            schema_editor.remove_index(Recipe, index)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_FTS_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+    """Search indexes exist only in the database, not in model state:
+    PostgreSQL gets GIN indexes, SQLite an FTS5 table with triggers."""
+
+    dependencies = [
+        ('recipes', '0005_shoppinglistitem'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
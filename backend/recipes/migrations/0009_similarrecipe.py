@@ -0,0 +1,58 @@
+# Generated by Django 3.2 on 2026-10-18 05:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from recipes.similarity import SimilarityIndex, common_posting
+
+
+def fill_similar_recipes(apps, schema_editor):
+    Component = apps.get_model('recipes', 'Component')
+    TagRecipe = apps.get_model('recipes', 'TagRecipe')
+    SimilarRecipe = apps.get_model('recipes', 'SimilarRecipe')
+
+    def sets(rows):
+        found = {}
+        for recipe, item in rows.iterator():
+            found.setdefault(recipe, set()).add(item)
+        return {recipe: frozenset(items) for recipe, items in found.items()}
+
+    ingredients = sets(Component.objects.values_list('recipe', 'ingredient'))
+    index = SimilarityIndex(ingredients,
+                            sets(TagRecipe.objects.values_list('recipe',
+                                                               'tag')),
+                            common_posting(len(ingredients)))
+    top_k = settings.SIMILAR_RECIPES['TOP_K']
+    SimilarRecipe.objects.bulk_create(
+        (SimilarRecipe(recipe_id=recipe, similar_id=similar, score=score)
+         for recipe in ingredients
+         for score, similar in index.top(recipe, top_k)),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_feedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar', to='recipes.recipe', verbose_name='Рецепт')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Похожий рецепт')),
+            ],
+            options={
+                'verbose_name': 'Похожий рецепт',
+                'verbose_name_plural': 'Похожие рецепты',
+                'ordering': ('recipe', '-score'),
+                'unique_together': {('recipe', 'similar')},
+            },
+        ),
+        migrations.RunPython(fill_similar_recipes,
+                             migrations.RunPython.noop),
+    ]
@@ -1,7 +1,19 @@
+from collections import defaultdict
+
 from colorfield.fields import ColorField
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import EmptyResultSet
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import (Case, Count, F, IntegerField, Sum, Value, When,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, RowNumber
+
+from users.models import Subscription, lock_users
+
+from .similarity import SimilarityIndex, common_posting
 
 User = get_user_model()
 
@@ -35,18 +47,50 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def limited_per_author(self, limit):
+        """Keeps at most `limit` latest recipes of every author."""
+        ranked = (
+            self
+            .annotate(author_row=Window(expression=RowNumber(),
+                                        partition_by=F('author'),
+                                        order_by=F('pk').desc()))
+            .order_by()
+            .values('pk', 'author_row')
+        )
+        try:
+            sql, params = ranked.query.sql_with_params()
+        except EmptyResultSet:  # E.g. no authors to take recipes of
+            return self.none()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE author_row <= %s',
+            (*params, limit)))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(to=User, on_delete=models.CASCADE,
                                related_name='recipes', verbose_name='Автор')
     name = models.CharField(max_length=200, verbose_name='Название')
     text = models.TextField(max_length=2000, verbose_name='Описание')
-    image = models.ImageField(upload_to='recipes/images/',
+    # Indexed: shared files are deleted when no recipe refers to them
+    image = models.ImageField(upload_to='recipes/images/', db_index=True,
                               verbose_name='Картинка')
+    # Variant name to file name, filled in by `recipes.images`
+    image_variants = models.JSONField(default=dict, blank=True,
+                                      editable=False,
+                                      verbose_name='Варианты картинки')
     cooking_time = models.IntegerField(validators=(MinValueValidator(1),),
                                        verbose_name='Длительность')
     tags = models.ManyToManyField(to=Tag, through='TagRecipe',
                                   verbose_name='Тэги')
 
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В избранном')
+    in_carts_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='В корзинах')
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
@@ -56,6 +100,37 @@ class Recipe(models.Model):
         return f'{self.name} от {self.author}'
 
 
+class ComponentManager(models.Manager):
+    def set_amounts(self, recipe, amounts):
+        """Makes the components of `recipe` match {ingredient id: amount}.
+
+        Only rows that differ are written. Uses prefetched components if
+        there are any; returns their amounts as they were. Bulk writes send
+        no `post_save`: callers tell the caches themselves.
+        """
+        components = {component.ingredient_id: component
+                      for component in recipe.ingredients.all()}
+        before = {ingredient: component.amount
+                  for ingredient, component in components.items()}
+        removed = before.keys() - amounts.keys()
+        if removed:
+            self.filter(recipe=recipe, ingredient__in=removed).delete()
+        changed = [component for ingredient, component in components.items()
+                   if amounts.get(ingredient, component.amount)
+                   != component.amount]
+        for component in changed:
+            component.amount = amounts[component.ingredient_id]
+        if changed:
+            self.bulk_update(changed, ('amount',))
+        added = [Component(recipe=recipe, ingredient_id=ingredient,
+                           amount=amount)
+                 for ingredient, amount in amounts.items()
+                 if ingredient not in components]
+        if added:
+            self.bulk_create(added)
+        return before
+
+
 class Component(models.Model):
     recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE,
                                related_name='ingredients',
@@ -66,6 +141,8 @@ class Component(models.Model):
     amount = models.IntegerField(validators=(MinValueValidator(1),),
                                  verbose_name='Количество')
 
+    objects = ComponentManager()
+
     class Meta:
         verbose_name = 'Компонент'
         verbose_name_plural = 'Компоненты'
@@ -92,6 +169,72 @@ class TagRecipe(models.Model):
         return f'{self.recipe} → {self.tag}'
 
 
+class RecipeListManager(models.Manager):
+    """Manager of user recipe lists: favorites, shopping cart.
+
+    Views add and remove recipes through `link`/`unlink`, which call
+    `on_link`/`on_unlink` in the same transaction, so data derived from
+    the list follows it.
+    """
+
+    counter = None  # Recipe field counting the lists a recipe is in
+
+    def link(self, user, recipes):
+        """Adds `recipes` to the list of `user`; returns the ids added."""
+        # Concurrent requests of the user wait here; otherwise both would
+        # count the same recipes as added, though one insert is skipped
+        lock_users((user.pk,))
+        listed = set(self.filter(user=user, recipe__in=recipes)
+                         .values_list('recipe', flat=True))
+        added = [recipe for recipe in recipes if recipe not in listed]
+        if added:
+            self.bulk_create(
+                (self.model(user=user, recipe_id=recipe) for recipe in added),
+                ignore_conflicts=True)
+            self.on_link(user, added)
+        return added
+
+    def unlink(self, user, recipes):
+        """Removes `recipes` from the list of `user`; returns the ids."""
+        lock_users((user.pk,))
+        links = self.filter(user=user, recipe__in=recipes)
+        removed = list(links.order_by().values_list('recipe', flat=True))
+        if removed:
+            links.delete()
+            self.on_unlink(user, removed)
+        return removed
+
+    def on_link(self, user, recipes):
+        self._count(recipes, 1)
+
+    def on_unlink(self, user, recipes):
+        self._count(recipes, -1)
+
+    def _count(self, recipes, delta):
+        if self.counter is None:
+            return
+        # Rows added outside the API (admin, fixtures) were never counted:
+        # the counter stops at zero, `reconcile_counters` fixes the drift
+        Recipe.objects.filter(pk__in=recipes).update(
+            **{self.counter: Greatest(F(self.counter) + delta, 0)})
+
+
+class FavoriteRecipeManager(RecipeListManager):
+    counter = 'favorites_count'
+
+
+class ShoppingCartManager(RecipeListManager):
+    counter = 'in_carts_count'
+
+    def on_link(self, user, recipes):
+        super().on_link(user, recipes)
+        ShoppingListItem.objects.add_recipes(user, recipes)
+
+    def on_unlink(self, user, recipes):
+        super().on_unlink(user, recipes)
+        ShoppingListItem.objects.remove_recipes(user, recipes)
+
+
 class FavoriteRecipe(models.Model):
     user = models.ForeignKey(to=User, on_delete=models.CASCADE,
                              related_name='favorites',
@@ -100,6 +243,8 @@ class FavoriteRecipe(models.Model):
                                related_name='favorited_by',
                                verbose_name='Рецепт')
 
+    objects = FavoriteRecipeManager()
+
     class Meta:
         verbose_name = 'Избранный рецепт'
         verbose_name_plural = 'Избранные рецепты'
@@ -115,8 +260,379 @@ class ShoppingCart(models.Model):
                                related_name='in_shopping_cart',
                                verbose_name='Рецепт')
 
+    objects = ShoppingCartManager()
+
     class Meta:
         verbose_name = 'Рецепт в корзине'
         verbose_name_plural = 'Рецепты в корзине'
         unique_together = ('user', 'recipe')
         ordering = ('user', 'recipe')
+
+
+class ShoppingListItemManager(models.Manager):
+    """Keeps shopping list totals in step with carts and recipes.
+
+    Every method expects to run inside the transaction that changes
+    the cart or the recipe components.
+    """
+
+    def add_recipes(self, user, recipes):
+        self._change((user.pk,), self._amounts(recipes))
+
+    def remove_recipes(self, user, recipes):
+        changes = {ingredient: -amount for ingredient, amount
+                   in self._amounts(recipes).items()}
+        self._change((user.pk,), changes)
+
+    def change_recipe(self, recipe, before, after):
+        """Applies a component change to every cart holding the recipe.
+
+        `before` and `after` map ingredient ids to amounts.
+        """
+        changes = {
+            ingredient: after.get(ingredient, 0) - before.get(ingredient, 0)
+            for ingredient in before.keys() | after.keys()}
+        changes = {ingredient: change for ingredient, change
+                   in changes.items() if change}
+        if changes:
+            users = ShoppingCart.objects.filter(
+                recipe=recipe).values_list('user_id', flat=True)
+            self._change(tuple(users), changes)
+
+    def discard_recipe(self, recipe):
+        self.change_recipe(recipe, self._amounts((recipe,)), {})
+
+    def compute(self, users):
+        """Totals {(user id, ingredient id): amount} built from carts."""
+        totals = (
+            Component.objects
+            .filter(recipe__in_shopping_cart__user__in=users)
+            .values_list('recipe__in_shopping_cart__user', 'ingredient')
+            .annotate(total_amount=Sum('amount'))
+            .order_by()
+        )
+        return {(user, ingredient): total_amount
+                for user, ingredient, total_amount in totals}
+
+    def stored(self, users):
+        items = self.filter(user__in=users).values_list(
+            'user', 'ingredient', 'total_amount')
+        return {(user, ingredient): total_amount
+                for user, ingredient, total_amount in items}
+
+    def rebuild(self, users):
+        self.filter(user__in=users).delete()
+        self.bulk_create(
+            ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                             total_amount=total_amount)
+            for (user, ingredient), total_amount
+            in self.compute(users).items())
+
+    def _amounts(self, recipes):
+        return dict(
+            Component.objects
+            .filter(recipe__in=recipes)
+            .values_list('ingredient')
+            .annotate(amount=Sum('amount'))
+            .order_by()
+        )
+
+    def _change(self, users, changes):
+        if not users or not changes:
+            return
+
+        # An upsert: rows missing here may be inserted by a concurrent
+        # transaction too, so they are created empty, conflicts skipped,
+        # and every change is then added by one update
+        self.bulk_create(
+            (ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                              total_amount=0)
+             for user in sorted(users)
+             for ingredient, change in sorted(changes.items())
+             if change > 0),
+            ignore_conflicts=True)
+        items = self.filter(user__in=users, ingredient__in=changes)
+        items.update(total_amount=F('total_amount') + Case(
+            *(When(ingredient=ingredient, then=Value(change))
+              for ingredient, change in changes.items()),
+            default=Value(0), output_field=IntegerField()))
+        items.filter(total_amount__lte=0).delete()
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE,
+                             related_name='shopping_list',
+                             verbose_name='Покупатель')
+    ingredient = models.ForeignKey(to=Ingredient, on_delete=models.CASCADE,
+                                   related_name='+',
+                                   verbose_name='Ингредиент')
+    total_amount = models.IntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        unique_together = ('user', 'ingredient')
+        ordering = ('user', 'ingredient')
+
+    def __str__(self):
+        return (f'{self.user} → {self.total_amount} '
+                f'{self.ingredient.measurement_unit} {self.ingredient}')
+
+
+class FeedEntryManager(models.Manager):
+    """Writes recipes to the feeds of their authors' subscribers.
+
+    Authors with more than `FEED['FAN_OUT_LIMIT']` subscribers are not
+    fanned out: their recipes are merged into feeds on read instead.
+    Fan-out resumes only below `FEED['FAN_OUT_RESUME']` subscribers, and
+    outside requests, in `resume_fan_out`.
+    """
+
+    def publish(self, recipe):
+        if self.is_celebrity(recipe.author_id):
+            return
+        subscribers = Subscription.objects.filter(
+            author=recipe.author_id).values_list('subscriber', flat=True)
+        self._insert(
+            FeedEntry(user_id=subscriber, recipe_id=recipe.pk,
+                      author_id=recipe.author_id)
+            for subscriber in subscribers.iterator())
+
+    def follow(self, user, authors):
+        """Backfills the feed of `user` with recipes of new `authors`."""
+        User.objects.filter(
+            pk__in=authors, subscribers_count__gt=self.fan_out_limit,
+            feed_merged_on_read=False).update(feed_merged_on_read=True)
+        recipes = (
+            Recipe.objects
+            .filter(author__in=authors, author__feed_merged_on_read=False)
+            .order_by()
+            .values_list('pk', 'author')
+        )
+        self._insert(
+            FeedEntry(user_id=user.pk, recipe_id=recipe, author_id=author)
+            for recipe, author in recipes.iterator())
+
+    def unfollow(self, user, authors):
+        self.filter(user=user, author__in=authors).delete()
+
+    def resume_fan_out(self):
+        """Fans out again authors who dropped to `FEED['FAN_OUT_RESUME']`.
+
+        Fills the feeds of all their subscribers, so it runs from the
+        `resume_feed_fan_out` command rather than on requests. Returns
+        the number of such authors.
+        """
+        authors = list(User.objects.filter(
+            feed_merged_on_read=True,
+            subscribers_count__lte=settings.FEED['FAN_OUT_RESUME'],
+        ).values_list('pk', flat=True))
+        resumed = 0
+        for author in authors:
+            # Switched first: recipes and subscriptions added from now on
+            # are fanned out on write, the earlier ones are backfilled here
+            if not User.objects.filter(
+                    pk=author, feed_merged_on_read=True).update(
+                    feed_merged_on_read=False):
+                continue
+            recipes = list(Recipe.objects.filter(
+                author=author).values_list('pk', flat=True))
+            subscribers = Subscription.objects.filter(
+                author=author).values_list('subscriber', flat=True)
+            self._insert(
+                FeedEntry(user_id=subscriber, recipe_id=recipe,
+                          author_id=author)
+                for subscriber in subscribers.iterator()
+                for recipe in recipes)
+            resumed += 1
+        return resumed
+
+    def rebuild(self, users):
+        self.filter(user__in=users).delete()
+        recipes = (
+            Recipe.objects
+            .filter(author__subscribers__subscriber__in=users,
+                    author__feed_merged_on_read=False)
+            .order_by()
+            .values_list('author__subscribers__subscriber', 'pk', 'author')
+        )
+        self._insert(
+            FeedEntry(user_id=user, recipe_id=recipe, author_id=author)
+            for user, recipe, author in recipes.iterator())
+
+    def feed(self, user, recipes=None):
+        """Recipes by authors `user` follows, as a `Recipe` queryset."""
+        recipes = Recipe.objects.all() if recipes is None else recipes
+        celebrities = list(
+            Subscription.objects
+            .filter(subscriber=user, author__feed_merged_on_read=True)
+            .values_list('author', flat=True))
+        if not celebrities:
+            return recipes.filter(feed_entries__user=user)
+        return recipes.filter(
+            models.Q(pk__in=self.filter(user=user).values('recipe'))
+            | models.Q(author__in=celebrities))
+
+    def is_celebrity(self, author):
+        return User.objects.filter(
+            pk=author, feed_merged_on_read=True).exists()
+
+    @property
+    def fan_out_limit(self):
+        return settings.FEED['FAN_OUT_LIMIT']
+
+    def _insert(self, entries):
+        batch_size = settings.FEED['BATCH_SIZE']
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == batch_size:
+                self.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            self.bulk_create(batch, ignore_conflicts=True)
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE,
+                             related_name='feed', verbose_name='Читатель')
+    recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE,
+                               related_name='feed_entries',
+                               verbose_name='Рецепт')
+    author = models.ForeignKey(to=User, on_delete=models.CASCADE,
+                               related_name='+', verbose_name='Автор')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        unique_together = ('user', 'recipe')
+        ordering = ('user', '-recipe')
+        indexes = (models.Index(fields=('user', 'author'),
+                                name='feed_user_author_idx'),)
+
+    def __str__(self):
+        return f'{self.user} ← {self.recipe}'
+
+
+class SimilarRecipeManager(models.Manager):
+    """Keeps the `SIMILAR_RECIPES['TOP_K']` recipes most like each one.
+
+    `rebuild` recomputes every list. `refresh` recomputes the list of a
+    recipe whose components changed from at most
+    `SIMILAR_RECIPES['MAX_CANDIDATES']` candidates and offers the recipe
+    to the lists of its closest neighbours; a neighbour that loses it
+    keeps a shorter list until the next rebuild.
+    """
+
+    def rebuild(self):
+        ingredients = self._sets(
+            Component.objects.values_list('recipe', 'ingredient'))
+        index = SimilarityIndex(
+            ingredients, self._sets(TagRecipe.objects.values_list(
+                'recipe', 'tag')),
+            common_posting(len(ingredients)))
+        top_k = settings.SIMILAR_RECIPES['TOP_K']
+
+        self.all().delete()
+        self._insert(
+            SimilarRecipe(recipe_id=recipe, similar_id=similar, score=score)
+            for recipe in ingredients
+            for score, similar in index.top(recipe, top_k))
+
+    def refresh(self, recipe):
+        rare = (
+            Component.objects
+            .filter(ingredient__in=Component.objects.filter(
+                recipe=recipe).values('ingredient'))
+            .values('ingredient')
+            .annotate(recipes=Count('recipe'))
+            .filter(recipes__lte=common_posting(Recipe.objects.count()))
+            .values('ingredient')
+        )
+        # Recipes sharing the most rare ingredients, so that a refresh
+        # reads the same number of rows however large the corpus grows
+        candidates = (
+            Component.objects
+            .filter(ingredient__in=rare)
+            .exclude(recipe=recipe)
+            .values('recipe')
+            .annotate(shared=Count('ingredient'))
+            .order_by('-shared', '-recipe')
+            .values('recipe')
+            [:settings.SIMILAR_RECIPES['MAX_CANDIDATES']]
+        )
+        related = models.Q(recipe=recipe) | models.Q(recipe__in=candidates)
+        index = SimilarityIndex(
+            self._sets(Component.objects.filter(related).values_list(
+                'recipe', 'ingredient')),
+            self._sets(TagRecipe.objects.filter(related).values_list(
+                'recipe', 'tag')))
+        if recipe.pk not in index.ingredients:  # No components
+            return
+        top_k = settings.SIMILAR_RECIPES['TOP_K']
+        # Only the closest neighbours are likely to rank the recipe high
+        # enough; bounding them bounds the rows touched per refresh.
+        closest = index.top(recipe.pk, top_k * 10)
+
+        entries = defaultdict(list)
+        for pk, owner, score in (
+                self.filter(recipe__in=[similar for _, similar in closest])
+                .exclude(similar=recipe)
+                .values_list('pk', 'recipe', 'score')):
+            entries[owner].append((score, pk))
+
+        rows = [SimilarRecipe(recipe_id=recipe.pk, similar_id=similar,
+                              score=score)
+                for score, similar in closest[:top_k]]
+        stale = []
+        for score, neighbour in closest:
+            if len(entries[neighbour]) >= top_k:
+                weakest_score, weakest = min(entries[neighbour])
+                if score <= weakest_score:
+                    continue
+                stale.append(weakest)
+            rows.append(SimilarRecipe(recipe_id=neighbour,
+                                      similar_id=recipe.pk, score=score))
+        self.filter(models.Q(recipe=recipe) | models.Q(similar=recipe)
+                    | models.Q(pk__in=stale)).delete()
+        self._insert(rows)
+
+    def _sets(self, rows):
+        sets = defaultdict(set)
+        for recipe, item in rows.iterator():
+            sets[recipe].add(item)
+        return {recipe: frozenset(items) for recipe, items in sets.items()}
+
+    def _insert(self, rows, batch_size=1000):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                self.bulk_create(batch)
+                batch = []
+        self.bulk_create(batch)
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(to=Recipe, on_delete=models.CASCADE,
+                               related_name='similar',
+                               verbose_name='Рецепт')
+    similar = models.ForeignKey(to=Recipe, on_delete=models.CASCADE,
+                                related_name='+',
+                                verbose_name='Похожий рецепт')
+    score = models.FloatField(verbose_name='Сходство')
+
+    objects = SimilarRecipeManager()
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        unique_together = ('recipe', 'similar')
+        ordering = ('recipe', '-score')
+
+    def __str__(self):
+        return f'{self.recipe} ≈ {self.similar}'
@@ -0,0 +1,96 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+SEARCH_VECTOR = (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                 + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+FTS_TABLE = 'recipes_recipe_fts'
+FTS_WEIGHTS = (10.0, 1.0)
+FTS_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert "
+    f"AFTER INSERT ON recipes_recipe BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, text) "
+    f"VALUES (new.id, new.name, new.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete "
+    f"AFTER DELETE ON recipes_recipe BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+    f"VALUES ('delete', old.id, old.name, old.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update "
+    f"AFTER UPDATE ON recipes_recipe BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+    f"VALUES ('delete', old.id, old.name, old.text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, text) "
+    f"VALUES (new.id, new.name, new.text); END",
+)
+
+
+def search_recipes(queryset, query):
+    """Filters recipes matching `query`, most relevant first.
+
+    PostgreSQL ranks full-text matches over name and text and lets
+    trigram similarity of the name catch typos. SQLite matches word
+    prefixes against an FTS5 table that triggers keep in sync.
+    """
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return _postgresql_search(queryset, query)
+    if vendor == 'sqlite':
+        return _sqlite_search(queryset, query)
+    return queryset.filter(Q(name__icontains=query)
+                           | Q(text__icontains=query))
+
+
+def _postgresql_search(queryset, query):
+    search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                               search_type='websearch')
+    return (
+        queryset
+        .alias(search=SEARCH_VECTOR)
+        .annotate(rank=SearchRank(SEARCH_VECTOR, search_query),
+                  similarity=TrigramSimilarity('name', query))
+        .filter(Q(search=search_query) | Q(name__trigram_similar=query))
+        .order_by('-rank', '-similarity', '-pk')
+    )
+
+
+def _sqlite_search(queryset, query):
+    words = re.findall(r'\w+', query)
+    if not words:
+        return queryset.none()
+
+    match = ' '.join('"{}"*'.format(word) for word in words)
+    weights = ', '.join(map(str, FTS_WEIGHTS))
+    return (
+        queryset
+        .filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,)))
+        .annotate(rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = {queryset.model._meta.db_table}.id',
+            (match,)))
+        .order_by('-rank', '-pk')
+    )
+
+
+def ensure_fts_triggers(sender, connection, **kwargs):
+    """Restores the SQLite FTS triggers on connect.
+
+    SQLite migrations rebuild `recipes_recipe` to alter it, which drops
+    the triggers; the indexed content itself survives the rebuild.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE name = %s',
+                       (FTS_TABLE,))
+        if cursor.fetchone():
+            for trigger in FTS_TRIGGERS:
+                cursor.execute(trigger)
@@ -0,0 +1,65 @@
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+
+# Ingredients found in more recipes than this (salt, water...) do not
+# make recipes candidates for similarity, though they still count in
+# the overlap of candidates found through rarer ingredients.
+MIN_COMMON_POSTING = 100
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    common = len(first & second)
+    return common / (len(first) + len(second) - common)
+
+
+def common_posting(recipes_total):
+    share = settings.SIMILAR_RECIPES['MAX_INGREDIENT_SHARE']
+    return max(int(recipes_total * share), MIN_COMMON_POSTING)
+
+
+class SimilarityIndex:
+    """Ingredient and tag sets of recipes, with postings to find overlaps.
+
+    Recipes are compared only with those sharing an uncommon ingredient,
+    so a recipe costs the length of a few postings instead of a pass
+    over every recipe.
+    """
+
+    def __init__(self, ingredients, tags, common_posting=None):
+        self.ingredients = ingredients  # {recipe id: frozenset}
+        self.tags = tags
+        self.tag_weight = settings.SIMILAR_RECIPES['TAG_WEIGHT']
+
+        postings = defaultdict(list)
+        for recipe, recipe_ingredients in ingredients.items():
+            for ingredient in recipe_ingredients:
+                postings[ingredient].append(recipe)
+        self.postings = {
+            ingredient: recipes for ingredient, recipes in postings.items()
+            if common_posting is None or len(recipes) <= common_posting}
+
+    def score(self, first, second):
+        empty = frozenset()
+        return (
+            (1 - self.tag_weight) * jaccard(self.ingredients[first],
+                                            self.ingredients[second])
+            + self.tag_weight * jaccard(self.tags.get(first, empty),
+                                        self.tags.get(second, empty))
+        )
+
+    def candidates(self, recipe):
+        found = set()
+        for ingredient in self.ingredients[recipe]:
+            found.update(self.postings.get(ingredient, ()))
+        found.discard(recipe)
+        return found
+
+    def top(self, recipe, k):
+        """[(score, recipe id)] of the `k` recipes most like `recipe`."""
+        return heapq.nlargest(
+            k, ((self.score(recipe, other), other)
+                for other in self.candidates(recipe)))
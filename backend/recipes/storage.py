@@ -0,0 +1,38 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files after their content.
+
+    Identical uploads share one file: saving content that is already
+    stored returns the name of the stored file. Shared files are deleted
+    by `recipes.images.release_image` once no recipe refers to them, or
+    by the `collect_media_garbage` command.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Counts as a new upload: garbage collection spares new files
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory,
+                              digest.hexdigest()[:32] + extension)
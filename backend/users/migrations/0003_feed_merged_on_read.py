@@ -0,0 +1,29 @@
+# Generated by Django 3.2 on 2026-10-18 06:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def flag_celebrities(apps, schema_editor):
+    # Their recipes have been merged into feeds on read so far; the
+    # counters are filled by recipes.0007_counters
+    apps.get_model('users', 'User').objects.filter(
+        subscribers_count__gt=settings.FEED['FAN_OUT_LIMIT'],
+    ).update(feed_merged_on_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_counters'),
+        ('users', '0002_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='feed_merged_on_read',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Рецепты подмешиваются в ленты при чтении'),
+        ),
+        migrations.RunPython(flag_celebrities, migrations.RunPython.noop),
+    ]
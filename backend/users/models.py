@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.db import models
+from django.db.models.functions import Greatest
 
 
 class User(AbstractUser):
@@ -30,6 +31,16 @@ class User(AbstractUser):
     subscribed = models.ManyToManyField(to='self', through='Subscription',
                                         symmetrical=False,)
 
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Рецептов')
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Подписчиков')
+    # Set past `FEED['FAN_OUT_LIMIT']` subscribers, cleared by the
+    # `resume_feed_fan_out` command; see `recipes.models.FeedEntryManager`
+    feed_merged_on_read = models.BooleanField(
+        default=False, editable=False,
+        verbose_name='Рецепты подмешиваются в ленты при чтении')
+
     @property
     def is_admin(self):
         return self.role == self.Roles.ADMIN
@@ -44,6 +55,64 @@ class User(AbstractUser):
         return self.username
 
 
+def lock_users(users):
+    """Locks the rows of `users` (ids) until the end of the transaction.
+
+    Rows are locked in the order of ids, so transactions locking sets
+    that overlap wait for each other instead of deadlocking.
+    """
+    list(User.objects.select_for_update().filter(pk__in=users)
+         .order_by('pk').values_list('pk', flat=True))
+
+
+class SubscriptionManager(models.Manager):
+    """Manager of subscriptions.
+
+    Views subscribe and unsubscribe through `link`/`unlink`, which call
+    `on_link`/`on_unlink` in the same transaction, so author counters
+    follow the subscriptions.
+    """
+
+    def link(self, subscriber, authors):
+        """Subscribes to `authors`; returns the ids subscribed to."""
+        # Requests involving any of these users wait here, so the ids
+        # read below are exactly the rows inserted and counted
+        lock_users({subscriber.pk, *authors})
+        followed = set(self.filter(subscriber=subscriber, author__in=authors)
+                           .values_list('author', flat=True))
+        added = [author for author in authors if author not in followed]
+        if added:
+            self.bulk_create(
+                (self.model(subscriber=subscriber, author_id=author)
+                 for author in added),
+                ignore_conflicts=True)
+            self.on_link(subscriber, added)
+        return added
+
+    def unlink(self, subscriber, authors):
+        """Unsubscribes from `authors`; returns the ids unsubscribed from."""
+        lock_users({subscriber.pk, *authors})
+        subscriptions = self.filter(subscriber=subscriber, author__in=authors)
+        removed = list(subscriptions.order_by()
+                                    .values_list('author', flat=True))
+        if removed:
+            subscriptions.delete()
+            self.on_unlink(subscriber, removed)
+        return removed
+
+    def on_link(self, subscriber, authors):
+        self._count(authors, 1)
+
+    def on_unlink(self, subscriber, authors):
+        self._count(authors, -1)
+
+    def _count(self, authors, delta):
+        # Stops at zero for subscriptions made outside the API; see
+        # `reconcile_counters`
+        User.objects.filter(pk__in=authors).update(subscribers_count=Greatest(
+            models.F('subscribers_count') + delta, 0))
+
+
 class Subscription(models.Model):
     subscriber = models.ForeignKey(to=User, on_delete=models.CASCADE,
                                    related_name='subscriptions',
@@ -52,6 +121,8 @@ class Subscription(models.Model):
                                related_name='subscribers',
                                verbose_name='Подписан на')
 
+    objects = SubscriptionManager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'